@@ -0,0 +1,54 @@
+# Export ml-models (YOLO and SAM-2 image encoder) for CPU inference backends.
+#
+# Exported models are written to the configured weights directory and are picked up
+# by the Celery workers if the configuration `ml_backend` is set accordingly.
+#
+# Usage:
+#   uv run python scripts/export-models.py onnx
+#   uv run python scripts/export-models.py openvino
+#   uv run python scripts/export-models.py onnx --int8
+#
+# With `--int8` the exported ONNX models are additionally quantized (dynamic
+# quantization to int8 weights) for the configuration `ml_precision = "int8"`.
+#
+# Requires `onnx` and `onnxruntime` (and `openvino` for the OpenVINO IR export).
+
+import argparse
+import logging
+
+from sketch_map_tool.config import CONFIG
+from sketch_map_tool.upload_processing.ml_models import (
+    export_sam2_encoder,
+    export_yolo,
+    quantize_sam2_encoder,
+    quantize_yolo,
+)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export ml-models.")
+    parser.add_argument("format", choices=["onnx", "openvino"])
+    parser.add_argument("--int8", action="store_true", help="quantize ONNX models")
+    args = parser.parse_args()
+    if args.int8 and args.format != "onnx":
+        parser.error("Quantization (--int8) is only supported for format onnx.")
+
+    for id in (CONFIG.yolo_osm_obj, CONFIG.yolo_esri_obj, CONFIG.yolo_cls):
+        path = export_yolo(id, args.format)
+        logging.info(f"Exported {id} to {path}")
+    # SAM-2 image encoder is run by ONNX Runtime for both backends.
+    # (OpenVINO is used as ONNX Runtime execution provider)
+    path = export_sam2_encoder()
+    logging.info(f"Exported SAM-2 image encoder to {path}")
+
+    if args.int8:
+        for id in (CONFIG.yolo_osm_obj, CONFIG.yolo_esri_obj, CONFIG.yolo_cls):
+            path = quantize_yolo(id)
+            logging.info(f"Quantized {id} to {path}")
+        path = quantize_sam2_encoder()
+        logging.info(f"Quantized SAM-2 image encoder to {path}")
+
+
+if __name__ == "__main__":
+    main()
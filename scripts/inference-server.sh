@@ -0,0 +1,3 @@
+#!/bin/bash
+# Run inference server for development
+uv run python -m sketch_map_tool.upload_processing.inference_server
@@ -55,6 +55,10 @@ CELERY_CONFIG = {
             "task": "sketch_map_tool.tasks.cleanup_map_frames",
             "schedule": timedelta(hours=3),
         },
+        "cleanup-artifacts": {
+            "task": "sketch_map_tool.tasks.cleanup_artifacts",
+            "schedule": timedelta(hours=3),
+        },
     },
 }
 
@@ -0,0 +1,155 @@
+"""Store for artifacts (e.g. raster results) outside of the Celery result backend.
+
+Tasks put artifacts (files) into the store and return a reference (`Artifact`)
+instead of the file content. The web app opens artifacts by reference on
+download. Hence, the store has to be accessible by the Celery workers and the web
+app.
+
+The store is configured by an URL (`artifact_store_url`):
+
+- `file:///path/to/dir`: Local filesystem (e.g. a volume shared by web app and
+  workers)
+
+Further stores (e.g. S3-compatible object storage) can be added by implementing
+`ArtifactStore` and registering the URL scheme in `get_artifact_store`.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import BinaryIO
+from urllib.parse import urlparse
+
+from sketch_map_tool.config import CONFIG
+
+
+class ArtifactStore(ABC):
+    """Interface of artifact stores. Artifacts are identified by keys."""
+
+    @abstractmethod
+    def put(self, key: str, path: str):
+        """Put a (local) file into the store. The file may be moved."""
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Open artifact for reading (binary)."""
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        """Size of artifact [bytes]."""
+
+    @abstractmethod
+    def etag(self, key: str) -> str:
+        """Entity tag of artifact. Changes if the artifact is replaced."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def cleanup(self, max_age: float):
+        """Delete artifacts older than given age [s]."""
+
+
+class LocalArtifactStore(ArtifactStore):
+    """Artifact store on the local filesystem. Keys are relative paths."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise ValueError("Invalid artifact key: " + key)
+        return path
+
+    def put(self, key: str, path: str):
+        destination = self._path(key)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # move is only atomic if the file is on the same filesystem. Otherwise it is
+        # copied. Move to a temporary file next to the destination first and rename it
+        # (atomic). Artifacts are never visible partially written.
+        fd, tmp = tempfile.mkstemp(dir=destination.parent, prefix=".", suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.move(path, tmp)
+            os.replace(tmp, destination)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def size(self, key: str) -> int:
+        return self._path(key).stat().st_size
+
+    def etag(self, key: str) -> str:
+        stat = self._path(key).stat()
+        return "{:x}-{:x}".format(stat.st_mtime_ns, stat.st_size)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def cleanup(self, max_age: float):
+        if not self.root.is_dir():
+            return
+        now = time.time()
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                try:
+                    if now - path.stat().st_mtime > max_age:
+                        path.unlink()
+                except FileNotFoundError:
+                    pass  # deleted in the meantime
+                except OSError as error:
+                    logging.warning("Could not delete artifact %s: %s", path, error)
+
+
+@dataclass(frozen=True)
+class Artifact:
+    """Reference to an artifact in the configured artifact store."""
+
+    key: str
+
+    def open(self) -> BinaryIO:
+        return get_artifact_store().open(self.key)
+
+    def size(self) -> int:
+        return get_artifact_store().size(self.key)
+
+    def etag(self) -> str:
+        return get_artifact_store().etag(self.key)
+
+    def exists(self) -> bool:
+        return get_artifact_store().exists(self.key)
+
+
+def is_enabled() -> bool:
+    return CONFIG.artifact_store_url != ""
+
+
+@cache
+def get_artifact_store() -> ArtifactStore:
+    url = urlparse(CONFIG.artifact_store_url)
+    match url.scheme:
+        case "file":
+            return LocalArtifactStore(url.path)
+        case _:
+            raise ValueError(
+                "Unsupported artifact store URL: " + CONFIG.artifact_store_url
+            )
@@ -0,0 +1,88 @@
+"""Least recently used (LRU) cache bounded by the memory size of its values.
+
+Used by Celery workers to cache decoded map frames and their features across
+tasks (see `tasks.get_map_frame`).
+"""
+
+import threading
+from collections import OrderedDict
+from operator import attrgetter
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """LRU cache bounded by the total size [bytes] of its values.
+
+    The size of a value is determined by `size_of` (default: `value.nbytes`).
+    Values larger than the maximum size are not cached.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        size_of: Callable[[Any], int] = attrgetter("nbytes"),
+    ):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._size_of = size_of
+        self._data: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get value and mark it as most recently used. Counts hits and misses."""
+        with self._lock:
+            try:
+                value, _ = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """Put value and evict least recently used values if cache is full."""
+        size = self._size_of(value)
+        with self._lock:
+            self._pop(key)
+            if size > self.max_size:
+                return
+            self._data[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.size -= evicted_size
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove value from cache."""
+        with self._lock:
+            return self._pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "items": len(self._data),
+            "size": self.size,
+        }
+
+    def _pop(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value, size = self._data.pop(key)
+        except KeyError:
+            return default
+        self.size -= size
+        return value
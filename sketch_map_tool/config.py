@@ -1,5 +1,6 @@
 import logging
 import os
+from typing import Literal
 
 from pydantic import computed_field, field_validator
 from pydantic_settings import (
@@ -23,13 +24,32 @@ def get_config_path() -> str:
 
 
 class Config(BaseSettings):
+    artifact_store_url: str = ""  # e.g. file:///app/artifacts. Empty: disabled
     cleanup_map_frames_interval: str = "12 months"
+    clip_coarse_max_side: int = 0  # coarse-to-fine matching. 0: disabled
+    clip_max_condition: float = 10.0
+    clip_max_reprojection_error: float = 3.0  # pixels
+    clip_min_area: float = 0.05  # relative to area of the photo
+    clip_min_aruco_markers: int = 4  # fall back to BRISK below
+    clip_min_inlier_ratio: float = 0.1
+    clip_min_inliers: int = 12
+    clip_seed: int = 0
     data_dir: str = str(get_project_root() / "data")  # TODO: make this a Path
     esri_api_key: str = ""
+    inference_server_address: str = ""  # path of Unix socket. Empty: in-process
+    inference_server_authkey: str = ""  # shared secret of server and workers
+    inference_server_batch_wait: float = 0.05  # seconds
+    inference_server_threads: int = 2  # threads running SAM at once
+    inference_server_timeout: float = 600  # seconds to wait for a response
     log_level: str = "INFO"
+    map_frame_cache_max_size: int = 1024  # MB per worker process. 0: disable cache
     max_nr_simultaneous_uploads: int = 100
+    ml_backend: Literal["torch", "onnx", "openvino"] = "torch"
+    ml_models_preload: bool = False
+    ml_precision: Literal["fp32", "int8"] = "fp32"
     model_type_sam: str = "vit_b"
     point_area_threshold: float = 0.00047
+    polygonize_mode: Literal["marking", "combined"] = "marking"
     postgres_host: str = "localhost"
     postgres_port: str = "5432"
     postgres_dbname: str = ""
@@ -40,6 +60,12 @@ class Config(BaseSettings):
     redis_db_number: str = ""
     redis_password: str = ""
     redis_username: str = ""
+    sam_batch_size: int = 16
+    sam_encoding: Literal["full", "roi"] = "full"
+    sam_roi_max_area: float = 0.5  # fall back to full encoding above this ratio
+    sam_roi_max_regions: int = 4  # fall back to full encoding above this number
+    sam_roi_padding: float = 0.25  # relative to bounding box size
+    scratch_dir: str = ""  # node-local directory of workers. Empty: disabled
     user_agent: str = "sketch-map-tool"
     weights_dir: str = str(get_project_root() / "weights")  # TODO: make this a Path
     wms_layers_esri_world_imagery: str = "world_imagery"
@@ -52,7 +78,9 @@ class Config(BaseSettings):
         "https://maps.heigit.org/raster/osm-carto/service?SERVICE=WMS&VERSION=1.1.1"
     )
     yolo_cls: str = "SMT-CLS"
+    yolo_cls_batch_size: int = 16
     yolo_esri_obj: str = "SMT-ESRI"
+    yolo_obj_batch_size: int = 8  # only used by the inference server
     yolo_osm_obj: str = "SMT-OSM"
 
     model_config = SettingsConfigDict(
@@ -24,6 +24,35 @@ def open_connection():
     dns = raw[3:]
     db_conn = psycopg2.connect(dns)
     db_conn.autocommit = True
+    migrate()
+
+
+def migrate():
+    """Migrate tables created by former versions.
+
+    Column `features` of table `map_frame` has been added later on. It is only
+    added to existing tables if missing, since `ALTER TABLE` locks the table.
+    This function is called once per connection (worker process).
+    """
+    query = """
+    SELECT
+        to_regclass('map_frame') IS NOT NULL
+        AND NOT EXISTS (
+            SELECT
+                *
+            FROM
+                information_schema.columns
+            WHERE
+                table_name = 'map_frame'
+                AND column_name = 'features')
+    """
+    with db_conn.cursor() as curs:
+        curs.execute(query)
+        if curs.fetchone()[0]:
+            logging.info("Add column `features` to table `map_frame`.")
+            curs.execute(
+                "ALTER TABLE map_frame ADD COLUMN IF NOT EXISTS features BYTEA"
+            )
 
 
 def close_connection():
@@ -40,11 +69,14 @@ def insert_map_frame(
     format_: PaperFormat,
     orientation: str,
     layer: str,
+    features: bytes | None = None,
 ):
     """Insert map frame alongside map generation parameters into the database.
 
     The UUID is the primary key.
     The map frame is needed for georeferencing the uploaded files (sketch maps).
+    Features of the map frame (see `clip.TemplateFeatures`) are precomputed to speed
+    up clipping of uploaded files.
     """
     create_query = """
         CREATE TABLE IF NOT EXISTS map_frame(
@@ -60,7 +92,8 @@ def insert_map_frame(
             version VARCHAR,
             created TIMESTAMP WITH TIME ZONE DEFAULT now(),
             downloaded TIMESTAMP WITH TIME ZONE,
-            iso_a2 VARCHAR DEFAULT NULL
+            iso_a2 VARCHAR DEFAULT NULL,
+            features BYTEA
             )
     """
     insert_query = """
@@ -74,7 +107,8 @@ def insert_map_frame(
             format,
             orientation,
             layer,
-            version
+            version,
+            features
             )
         VALUES (
             %s,
@@ -86,6 +120,7 @@ def insert_map_frame(
             %s,
             %s,
             %s,
+            %s,
             %s)
     """
     with db_conn.cursor() as curs:
@@ -103,15 +138,71 @@ def insert_map_frame(
                 orientation,
                 layer,
                 __version__,
+                features,
             ),
         )
 
 
-def cleanup_map_frames():
+def select_map_frame(uuid: UUID) -> bytes:
+    """Select map frame of the associated UUID."""
+    query = "SELECT file FROM map_frame WHERE uuid = %s"
+    with db_conn.cursor() as curs:
+        curs.execute(query, [str(uuid)])
+        raw = curs.fetchone()
+        if raw:
+            if raw[0] is None:
+                raise CustomFileDoesNotExistAnymoreError(
+                    N_("The file with the id: {UUID} does not exist anymore"),
+                    {"UUID": uuid},
+                )
+            return bytes(raw[0])
+        else:
+            raise CustomFileNotFoundError(
+                N_(
+                    "There is no map frame in the database with the uuid: {UUID}."
+                    " You can only upload sketch maps to the "
+                    "instance on which they have been created."
+                ),
+                {"UUID": uuid},
+            )
+
+
+def select_map_frame_exists(uuid: UUID) -> bool:
+    """Check if the map frame of the associated UUID exists (without fetching it)."""
+    query = "SELECT file IS NOT NULL FROM map_frame WHERE uuid = %s"
+    with db_conn.cursor() as curs:
+        curs.execute(query, [str(uuid)])
+        raw = curs.fetchone()
+    return raw is not None and raw[0]
+
+
+def select_map_frame_features(uuid: UUID) -> bytes | None:
+    """Select precomputed features of the map frame of the associated UUID.
+
+    Returns None for map frames generated before features were precomputed.
+    """
+    query = "SELECT features FROM map_frame WHERE uuid = %s"
+    with db_conn.cursor() as curs:
+        curs.execute(query, [str(uuid)])
+        raw = curs.fetchone()
+    if raw is None or raw[0] is None:
+        return None
+    return bytes(raw[0])
+
+
+def update_map_frame_features(uuid: UUID, features: bytes):
+    """Store features of the map frame of the associated UUID (backfill)."""
+    query = "UPDATE map_frame SET features = %s WHERE uuid = %s"
+    with db_conn.cursor() as curs:
+        curs.execute(query, [features, str(uuid)])
+
+
+def cleanup_map_frames() -> list[UUID]:
     """Cleanup map frames which are old and without consent.
 
     Only set file and bbox to null. Keep metadata.
     This function is called by a periodic celery task.
+    Returns UUIDs of cleaned up map frames.
     """
     query = """
     UPDATE
@@ -119,7 +210,8 @@ def cleanup_map_frames():
     SET
         file = NULL,
         bbox = NULL,
-        bbox_wgs84 = NULL
+        bbox_wgs84 = NULL,
+        features = NULL
     WHERE
         created < NOW() - INTERVAL %s
         AND NOT EXISTS (
@@ -129,13 +221,17 @@ def cleanup_map_frames():
                 blob
             WHERE
                 map_frame.uuid = blob.map_frame_uuid
-                AND consent = TRUE);
+                AND consent = TRUE)
+    RETURNING
+        uuid;
     """
     with db_conn.cursor() as curs:
         try:
             curs.execute(query, [CONFIG.cleanup_map_frames_interval])
         except UndefinedTable:
             logging.info("Table `map_frame` does not exist yet. Nothing todo.")
+            return []
+        return [UUID(str(row[0])) for row in curs.fetchall()]
 
 
 def cleanup_blob(file_ids: list[int] | tuple[int]):
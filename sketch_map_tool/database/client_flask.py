@@ -133,7 +133,19 @@ def select_file_name(id_: int) -> str:
 
 def select_map_frame(uuid: UUID) -> tuple[bytes, str, str]:
     """Select map frame, bbox and layer of the associated UUID."""
-    query = "SELECT file FROM map_frame WHERE uuid = %s"
+    return _select_map_frame(uuid, "file")
+
+
+def select_map_frame_size(uuid: UUID) -> int:
+    """Select size [bytes] of the map frame of the associated UUID.
+
+    Raises the same errors as `select_map_frame` without fetching the map frame.
+    """
+    return _select_map_frame(uuid, "octet_length(file)")
+
+
+def _select_map_frame(uuid: UUID, column: str):
+    query = "SELECT {} FROM map_frame WHERE uuid = %s".format(column)
     db_conn = open_connection()
     with db_conn.cursor() as curs:
         try:
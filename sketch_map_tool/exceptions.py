@@ -75,5 +75,9 @@ class MarkingDetectionError(TranslatableError):
     pass
 
 
+class ClippingError(TranslatableError):
+    pass
+
+
 class TimeLimitExceededError(TranslatableError, TimeLimitExceeded):
     pass
@@ -1,7 +1,9 @@
-from io import BytesIO
+import time
+from functools import cache
+from io import BytesIO, RawIOBase
 from pathlib import Path
-from typing import assert_never
-from zipfile import ZipFile
+from typing import Iterator, assert_never
+from zipfile import ZipFile, ZipInfo
 
 import cv2
 import numpy as np
@@ -9,6 +11,7 @@ from billiard.exceptions import TimeLimitExceeded
 from celery.result import AsyncResult, GroupResult
 from geojson import Feature, FeatureCollection
 from numpy.typing import NDArray
+from pyproj import Transformer
 from reportlab.graphics.shapes import Drawing
 
 from sketch_map_tool.exceptions import TimeLimitExceededError, TranslatableError
@@ -33,10 +36,44 @@ def resize_rlg_by_height(d: Drawing, size: float) -> Drawing:
     return d
 
 
+@cache
+def get_transformer(
+    crs_from: str,
+    crs_to: str,
+    always_xy: bool = False,
+) -> Transformer:
+    """Get a transformer. Transformers are cached, since creating them is costly."""
+    return Transformer.from_crs(crs_from, crs_to, always_xy=always_xy)
+
+
 def to_array(buffer: bytes) -> NDArray:
     return cv2.imdecode(np.frombuffer(buffer, dtype="uint8"), cv2.IMREAD_UNCHANGED)
 
 
+def get_memory_usage() -> dict[str, int]:
+    """Get memory usage of the current process in kB.
+
+    Read from `/proc/self/smaps_rollup` (Linux only, empty otherwise):
+        rss: Resident set size
+        pss: Proportional set size (shared memory is divided by number of processes)
+        uss: Unique set size (private memory)
+    """
+    try:
+        with open("/proc/self/smaps_rollup", "r") as file:
+            lines = file.readlines()
+    except OSError:
+        return {}
+    values = {}
+    for line in lines[1:]:  # skip header
+        key, value, *_ = line.split()
+        values[key.rstrip(":")] = int(value)
+    return {
+        "rss": values["Rss"],
+        "pss": values["Pss"],
+        "uss": values["Private_Clean"] + values["Private_Dirty"],
+    }
+
+
 def N_(s: str) -> str:  # noqa
     """Mark for translation."""
     return s
@@ -56,20 +93,62 @@ def merge(fcs: list[FeatureCollection]) -> FeatureCollection:
     return feature_collection
 
 
-def zip_(results: list[tuple[str, str, BytesIO]]) -> BytesIO:
-    """ZIP the raster results of the Celery group of `upload_processing` tasks."""
-    buffer = BytesIO()
+def iter_zip(
+    results: list[tuple[str, str, BytesIO]],
+    chunk_size: int = 1024**2,
+) -> Iterator[bytes]:
+    """ZIP the raster results of the Celery group of `upload_processing` tasks.
+
+    The ZIP is returned as stream of chunks. Raster results are either in-memory
+    buffers or references to files (e.g. `artifact_store.Artifact`), which are
+    opened on demand and read chunk by chunk. Only one chunk of a raster result is
+    held in memory at a time.
+    """
+    stream = _ZipStream()
     attributions = []
-    with ZipFile(buffer, "a") as zip_file:
+    with ZipFile(stream, "w") as zip_file:
         for file_name, attribution, file in results:
-            stem = Path(file_name).stem
-            name = Path(stem).with_suffix(".geotiff")
-            zip_file.writestr(str(name), file.read())
+            zip_info = ZipInfo(
+                get_raster_result_name(file_name),
+                date_time=time.localtime()[:6],
+            )
+            if isinstance(file, BytesIO):
+                zip_info.file_size = file.getbuffer().nbytes
+                source = file
+            else:
+                zip_info.file_size = file.size()
+                source = file.open()
+            with source, zip_file.open(zip_info, "w") as entry:
+                while chunk := source.read(chunk_size):
+                    entry.write(chunk)
+                    yield stream.pop()
             attributions.append(attribution.replace("<br />", "\n"))
-        file = BytesIO("\n".join(set(attributions)).encode())
-        zip_file.writestr("attributions.txt", file.read())
-    buffer.seek(0)
-    return buffer
+        zip_file.writestr("attributions.txt", "\n".join(set(attributions)))
+    yield stream.pop()
+
+
+class _ZipStream(RawIOBase):
+    """Non-seekable, writable stream. Written bytes are collected until popped."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def get_raster_result_name(file_name: str) -> str:
+    stem = Path(file_name).stem
+    return str(Path(stem).with_suffix(".geotiff"))
 
 
 def extract_errors(
@@ -104,8 +183,29 @@ def extract_errors(
                     ) from error
                 except TimeLimitExceededError as error_:
                     errors.append(error_.translate())
-            if type_ in ("vector-results"):
+            # errors returned by `upload_processing`. Errors of sketch maps which
+            # could not be clipped concern raster results as well.
+            if (type_ == "vector-results" and r.successful()) or (
+                type_ == "raster-results" and is_unclipped(r)
+            ):
                 _, _, _, _, errors_ = r.get(propagate=False)
                 if len(errors_) > 0:
                     errors = errors + [e.translate() for e in errors_]
     return errors
+
+
+def is_unclipped(result: AsyncResult) -> bool:
+    """Check if the sketch map of an `upload_processing` task could not be clipped.
+
+    In this case the task succeeds without raster result, but with errors.
+    """
+    if not result.successful():
+        return False
+    value = result.get(propagate=False)
+    # legacy raster results are buffers
+    return isinstance(value, (tuple, list)) and value[2] is None
+
+
+def is_failed(result: AsyncResult) -> bool:
+    """Check if an `upload_processing` task failed or could not clip its sketch map."""
+    return not result.successful() or is_unclipped(result)
@@ -0,0 +1,127 @@
+"""Per-stage instrumentation of tasks: wall time, CPU time and peak memory.
+
+Usage:
+    with record_stages() as stages:
+        with stage("clip"):
+            ...
+        with stage("georeference"):
+            ...
+    stages.to_dict()
+
+Stages are recorded in a context variable. Outside of `record_stages` (e.g. in the
+inference server) `stage` does nothing. Stages with the same name (e.g. per marking)
+are aggregated. Stages must not be nested, because the peak memory is reset at the
+beginning of each stage.
+
+A callback (e.g. to publish the stages recorded so far) can be passed to
+`record_stages`. It is called after each stage.
+"""
+
+import json
+import logging
+import resource
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Iterator
+
+
+@dataclass
+class Stage:
+    wall_time: float = 0.0  # [s]
+    cpu_time: float = 0.0  # [s]
+    peak_rss: int = 0  # [kB]
+    count: int = 0
+
+
+@dataclass
+class Stages:
+    stages: dict[str, Stage] = field(default_factory=dict)
+    callback: Callable[["Stages"], None] | None = field(default=None, repr=False)
+
+    def add(self, name: str, wall_time: float, cpu_time: float, peak_rss: int):
+        stage = self.stages.setdefault(name, Stage())
+        stage.wall_time += wall_time
+        stage.cpu_time += cpu_time
+        stage.peak_rss = max(stage.peak_rss, peak_rss)
+        stage.count += 1
+
+    def to_dict(self) -> dict[str, dict]:
+        return {name: asdict(stage) for name, stage in self.stages.items()}
+
+
+_stages: ContextVar[Stages | None] = ContextVar("stages", default=None)
+
+
+@contextmanager
+def record_stages(
+    callback: Callable[[Stages], None] | None = None,
+) -> Iterator[Stages]:
+    """Record stages run inside this context.
+
+    If given, `callback` is called with the recorded stages after each stage.
+    """
+    stages = Stages(callback=callback)
+    token = _stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _stages.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Measure wall time, CPU time and peak resident set size of a stage."""
+    stages = _stages.get()
+    if stages is None:
+        yield
+        return
+    reset_peak_rss()
+    wall_time = time.perf_counter()
+    cpu_time = time.process_time()
+    try:
+        yield
+    finally:
+        stages.add(
+            name,
+            time.perf_counter() - wall_time,
+            time.process_time() - cpu_time,
+            get_peak_rss(),
+        )
+        if stages.callback is not None:
+            stages.callback(stages)
+
+
+def log_stages(stages: Stages, **kwargs):
+    """Log stages as one structured (JSON) log line.
+
+    Keyword arguments (e.g. task name and ID) are added to the log line to be able
+    to aggregate stages across tasks and workers.
+    """
+    logging.info(json.dumps({**kwargs, "stages": stages.to_dict()}))
+
+
+def reset_peak_rss():
+    """Reset peak resident set size of the current process (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss() -> int:
+    """Get peak resident set size [kB] of the current process.
+
+    Falls back to the maximum resident set size since process start if the peak
+    can not be read from `/proc/self/status` (Linux only).
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
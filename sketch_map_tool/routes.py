@@ -4,7 +4,7 @@ from io import BytesIO
 from uuid import UUID
 
 import geojson
-from celery import chord, group
+from celery import chain, chord, group
 from celery.result import AsyncResult, GroupResult
 from flask import (
     abort,
@@ -16,8 +16,15 @@ from flask import (
 )
 from werkzeug import Response
 
-from sketch_map_tool import celery_app, definitions, tasks, usage_charts
+from sketch_map_tool import (
+    artifact_store,
+    celery_app,
+    definitions,
+    tasks,
+    usage_charts,
+)
 from sketch_map_tool import flask_app as app
+from sketch_map_tool.artifact_store import Artifact
 from sketch_map_tool.config import CONFIG
 from sketch_map_tool.database import client_flask as db_client_flask
 from sketch_map_tool.definitions import REQUEST_TYPES
@@ -32,13 +39,15 @@ from sketch_map_tool.exceptions import (
 from sketch_map_tool.helpers import (
     N_,
     extract_errors,
+    is_failed,
+    iter_zip,
     merge,
-    to_array,
-    zip_,
 )
 from sketch_map_tool.models import Bbox, PaperFormat, Size, validate_layer
 from sketch_map_tool.tasks import (
+    assemble_results,
     cleanup_blobs,
+    get_download_key,
     upload_processing,
 )
 from sketch_map_tool.validators import (
@@ -212,14 +221,14 @@ def digitize_results_post(lang="en") -> Response:
 
     bboxes_ = dict()
     layers_ = dict()
-    map_frames = dict()
-    for uuid in set(uuids):  # Only retrieve map_frame once per uuid to save memory
+    for uuid in set(uuids):
+        # Only check if map frame exists. Map frames are passed by UUID and loaded
+        # by the worker.
         # NOTE: bbox and layer could be return once per UUID from DB here
         # instead of multiple times from QR code above.
         # But this does not work with legacy map frames (version 2024.04.15),
         # since those attributes are not stored in the DB.
-        map_frame = db_client_flask.select_map_frame(UUID(uuid))
-        map_frames[uuid] = to_array(BytesIO(map_frame).read())
+        db_client_flask.select_map_frame_size(UUID(uuid))
     for bbox, layer, uuid in zip(bboxes, layers, uuids):
         bboxes_[uuid] = bbox
         layers_[uuid] = layer
@@ -231,19 +240,23 @@ def digitize_results_post(lang="en") -> Response:
                 (
                     file_id,
                     file_name,
-                    map_frames[uuid],
+                    uuid,
                     layers_[uuid],
                     bboxes_[uuid],
                 )
             )
         )
-    chord_ = chord(
-        group(tasks),
-        cleanup_blobs.signature(
-            kwargs={"file_ids": list(set(file_ids))},
-            immutable=True,
-        ),
-    ).apply_async()
+    header = group(tasks)
+    callback = cleanup_blobs.signature(
+        kwargs={"file_ids": list(set(file_ids))},
+        immutable=True,
+    )
+    if artifact_store.is_enabled():
+        # assemble downloads once all tasks have succeeded. The group is frozen to
+        # know its ID (UUID of the results) in advance.
+        group_id = header.freeze().id
+        callback = chain(assemble_results.s(group_id), callback)
+    chord_ = chord(header, callback).apply_async()
     async_group_result = chord_.parent
 
     # group results have to be saved for them to be able to be restored later
@@ -299,18 +312,20 @@ def status(uuid: str, type_: REQUEST_TYPES, lang="en") -> Response:
     info = ""
     errors: list = extract_errors(async_result, type_)
     if async_result.ready():
-        if async_result.successful():  # SUCCESS
+        if isinstance(async_result, GroupResult):
+            # partial success: results of the other sketch maps can be downloaded
+            failed = all([is_failed(r) for r in async_result.results])  # type: ignore
+            succeeded = not failed
+        else:
+            failed = async_result.failed()
+            succeeded = async_result.successful()
+        if succeeded:  # SUCCESS
             status = "SUCCESS"
             http_status = 200
             href = "/api/download/" + uuid + "/" + type_
-        elif async_result.failed():  # REJECTED, REVOKED, FAILURE
+        elif failed:  # REJECTED, REVOKED, FAILURE
             status = "FAILURE"
             http_status = 422  # Unprocessable Entity
-            if isinstance(async_result, GroupResult):
-                if any([r.successful() for r in async_result.results]):  # type: ignore
-                    status = "SUCCESS"
-                    http_status = 200
-                    href = "/api/download/" + uuid + "/" + type_
         else:
             abort(500)
     else:  # PENDING, RETRY, STARTED
@@ -356,7 +371,7 @@ def download(uuid: str, type_: REQUEST_TYPES, lang="en") -> Response:
     # Abort if result not ready or failed.
     # No nice error message here because user should first check /api/status.
     if isinstance(async_result, GroupResult):
-        if not async_result.ready() or all([r.failed() for r in async_result.results]):
+        if not async_result.ready() or all(is_failed(r) for r in async_result.results):
             abort(500)
     else:
         if not async_result.ready() or async_result.failed():
@@ -373,27 +388,95 @@ def download(uuid: str, type_: REQUEST_TYPES, lang="en") -> Response:
             mimetype = "application/zip"
             download_name = type_ + ".zip"
             if isinstance(async_result, GroupResult):
-                results = async_result.get(propagate=False)
-                raster_results = [r[:-2] for r in results]
-                file: BytesIO = zip_(raster_results)
-            else:
-                # support legacy results
-                file: BytesIO = async_result.get()
+                return send_raster_results(uuid, async_result, mimetype, download_name)
+            # support legacy results
+            file: BytesIO = async_result.get()
         case "vector-results":
             db_client_flask.update_files_download_vector(uuid)
             mimetype = "application/geo+json"
             download_name = type_ + ".geojson"
             if isinstance(async_result, GroupResult):
-                results = async_result.get(propagate=False)
-                vector_results = [r[-2] for r in results]
-                raw = geojson.dumps(merge(vector_results))
-                file: BytesIO = BytesIO(raw.encode("utf-8"))
-            else:
-                # support legacy results
-                file = async_result.get()
+                return send_vector_results(uuid, async_result, mimetype, download_name)
+            # support legacy results
+            file = async_result.get()
     return send_file(file, mimetype, download_name=download_name)
 
 
+def get_download(uuid: str, type_: REQUEST_TYPES) -> Artifact | None:
+    """Get download of digitize results assembled by `assemble_results`.
+
+    Returns None if the artifact store is disabled or if the download has not been
+    assembled (e.g. because some tasks failed).
+    """
+    if not artifact_store.is_enabled():
+        return None
+    artifact = Artifact(get_download_key(uuid, type_))
+    if not artifact.exists():
+        return None
+    return artifact
+
+
+def send_artifact(artifact: Artifact, mimetype: str, download_name: str) -> Response:
+    """Send artifact with ETag to support conditional requests (`If-None-Match`)."""
+    return send_file(
+        artifact.open(),
+        mimetype,
+        download_name=download_name,
+        conditional=True,
+        etag=artifact.etag(),
+    )
+
+
+def send_raster_results(
+    uuid: str,
+    async_result: GroupResult,
+    mimetype: str,
+    download_name: str,
+) -> Response:
+    """Send raster results of a group of `upload_processing` tasks as ZIP.
+
+    The ZIP assembled by `assemble_results` is sent if available. Otherwise it is
+    streamed entry by entry. Raster results stored in the artifact store are read
+    chunk by chunk.
+    """
+    if (artifact := get_download(uuid, "raster-results")) is not None:
+        return send_artifact(artifact, mimetype, download_name)
+    # skip sketch maps which could not be clipped
+    raster_results = [r[:-2] for r in get_results(async_result) if r[2] is not None]
+    return Response(
+        iter_zip(raster_results),
+        mimetype=mimetype,
+        headers={"Content-Disposition": "attachment; filename=" + download_name},
+    )
+
+
+def send_vector_results(
+    uuid: str,
+    async_result: GroupResult,
+    mimetype: str,
+    download_name: str,
+) -> Response:
+    """Send vector results of a group of `upload_processing` tasks merged as GeoJSON.
+
+    The GeoJSON assembled by `assemble_results` is sent if available.
+    """
+    if (artifact := get_download(uuid, "vector-results")) is not None:
+        return send_artifact(artifact, mimetype, download_name)
+    vector_results = [r[-2] for r in get_results(async_result)]
+    raw = geojson.dumps(merge(vector_results))
+    return send_file(
+        BytesIO(raw.encode("utf-8")),
+        mimetype,
+        download_name=download_name,
+    )
+
+
+def get_results(async_result: GroupResult) -> list:
+    """Get results of the succeeded tasks of a group. Failed tasks are skipped."""
+    results = async_result.get(propagate=False)
+    return [r for r in results if not isinstance(r, Exception)]
+
+
 @app.route("/api/health")
 @app.route("/<lang>/api/health")
 def health(lang="en"):
@@ -0,0 +1,62 @@
+"""Node-local scratch store for large rasters (`scratch_dir`).
+
+Large intermediate rasters of a task (e.g. the clipped sketch map frame) are
+memory-mapped files instead of heap memory. The kernel can write them back and
+free their pages under memory pressure.
+
+Large final rasters (the georeferenced sketch map frame) are written to scratch
+files before they are put into the artifact store (see `artifact_store`).
+Leftover scratch files (e.g. of crashed tasks) are removed by each worker process
+on start (see `cleanup`).
+"""
+
+import logging
+import tempfile
+import time
+from pathlib import Path
+from uuid import uuid4
+
+import numpy as np
+from numpy.typing import DTypeLike, NDArray
+
+from sketch_map_tool.config import CONFIG
+
+
+def is_enabled() -> bool:
+    return CONFIG.scratch_dir != ""
+
+
+def get_scratch_dir() -> Path:
+    path = Path(CONFIG.scratch_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def create_file(suffix: str = "") -> str:
+    """Create a path of a new (not yet existing) scratch file."""
+    return str(get_scratch_dir() / "{}{}".format(uuid4(), suffix))
+
+
+def create_array(shape: tuple[int, ...], dtype: DTypeLike) -> NDArray:
+    """Create a memory-mapped array backed by an anonymous scratch file.
+
+    The file is unlinked right away and is removed as soon as the array is garbage
+    collected.
+    """
+    with tempfile.NamedTemporaryFile(dir=get_scratch_dir()) as file:
+        return np.memmap(file, dtype=dtype, mode="w+", shape=shape)
+
+
+def cleanup(max_age: float):
+    """Remove scratch files older than given age [s]."""
+    if not is_enabled():
+        return
+    now = time.time()
+    for path in get_scratch_dir().iterdir():
+        try:
+            if path.is_file() and now - path.stat().st_mtime > max_age:
+                path.unlink()
+        except FileNotFoundError:
+            pass  # removed in the meantime
+        except OSError as error:
+            logging.warning("Could not remove scratch file %s: %s", path, error)
@@ -1,21 +1,43 @@
 import logging
+import math
+import os
+import tempfile
+import time
 from io import BytesIO
+from typing import Callable
+from uuid import UUID, uuid4
 
+import geojson
 from celery.result import AsyncResult
-from celery.signals import setup_logging, worker_process_init, worker_process_shutdown
+from celery.signals import (
+    setup_logging,
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+)
 from geojson import FeatureCollection
 from numpy.typing import NDArray
-from sam2.build_sam import build_sam2
-from sam2.sam2_image_predictor import SAM2ImagePredictor
-from ultralytics import YOLO
-from ultralytics_MB import YOLO as YOLO_MB
 
-from sketch_map_tool import CONFIG, map_generation
+from sketch_map_tool import CONFIG, artifact_store, map_generation, scratch
 from sketch_map_tool import celery_app as celery
+from sketch_map_tool.artifact_store import Artifact
+from sketch_map_tool.cache import LRUCache
 from sketch_map_tool.database import client_celery as db_client_celery
 from sketch_map_tool.definitions import get_attribution
-from sketch_map_tool.exceptions import MarkingDetectionError
-from sketch_map_tool.helpers import N_, merge, to_array
+from sketch_map_tool.exceptions import ClippingError, MarkingDetectionError
+from sketch_map_tool.helpers import (
+    N_,
+    get_memory_usage,
+    iter_zip,
+    merge,
+    to_array,
+)
+from sketch_map_tool.instrumentation import (
+    Stages,
+    log_stages,
+    record_stages,
+    stage,
+)
 from sketch_map_tool.models import Bbox, PaperFormat, Size
 from sketch_map_tool.openaerialmap import client as oam_client
 from sketch_map_tool.upload_processing import (
@@ -24,14 +46,35 @@ from sketch_map_tool.upload_processing import (
     polygonize,
     post_process,
 )
+from sketch_map_tool.upload_processing.clip import (
+    TemplateFeatures,
+    compute_template_features,
+)
 from sketch_map_tool.upload_processing.detect_markings import detect_markings
+from sketch_map_tool.upload_processing.georeference import (
+    crop_to_content,
+    write_geotiff,
+)
+from sketch_map_tool.upload_processing.inference_server import InferenceClient
 from sketch_map_tool.upload_processing.ml_models import (
-    init_model,
-    init_sam2,
-    select_computation_device,
+    fuse_yolo_models,
+    init_sam_predictor,
+    init_yolo_cls,
+    init_yolo_obj,
 )
+from sketch_map_tool.upload_processing.polygonize import polygonize_markings
 from sketch_map_tool.wms import client as wms_client
 
+# ml-models are loaded on worker (process) initialization
+sam_predictor = None
+yolo_obj_osm = None
+yolo_obj_esri = None
+yolo_cls = None
+# if configured, ml-models are run by a separate inference server instead
+inference_client = InferenceClient(CONFIG.inference_server_address)
+# decoded map frames and their features are cached per worker process
+map_frame_cache = LRUCache(CONFIG.map_frame_cache_max_size * 1024**2)
+
 
 @worker_process_init.connect
 def init_worker_db_connection(**_):
@@ -40,33 +83,77 @@ def init_worker_db_connection(**_):
     db_client_celery.open_connection()
 
 
+@worker_init.connect
+def preload_worker_ml_models(**_):
+    """Initializing machine-learning models once in the worker main process.
+
+    Only if configured (`ml_models_preload`). Child processes forked by the worker
+    share the read-only weights of the models (copy-on-write) instead of loading
+    their own copy. This also applies to child processes replacing old ones
+    (`worker_max_tasks_per_child`).
+    """
+    if not CONFIG.ml_models_preload or CONFIG.inference_server_address:
+        return
+    if CONFIG.ml_backend != "torch":
+        # ONNX Runtime sessions (and their thread pools) can not be used across fork
+        logging.warning(
+            "Preloading ml-models is only supported by the ml backend 'torch'. "
+            + "Initialize ml-models in each worker process instead."
+        )
+        return
+    load_ml_models()
+    fuse_yolo_models(yolo_obj_osm, yolo_obj_esri, yolo_cls)
+
+
 @worker_process_init.connect
 def init_worker_ml_models(**_):
     """Initializing machine-learning models for worker.
 
+    Skipped if models have already been loaded by the worker main process or if
+    models are run by the inference server (`inference_server_address`).
+    """
+    if CONFIG.inference_server_address:
+        logging.info("Use ml-models of the inference server.")
+    elif sam_predictor is None:
+        load_ml_models()
+    else:
+        logging.info("Use ml-models preloaded by the worker main process.")
+    memory = " ".join(f"{k}={v}kB" for k, v in get_memory_usage().items())
+    logging.info(f"Memory usage of worker process after initialization: {memory}")
+
+
+@worker_process_init.connect
+def cleanup_worker_scratch(**_):
+    """Cleanup leftover scratch files (e.g. of crashed tasks) of this machine.
+
+    The scratch directory is node-local. Hence, it is cleaned up by each worker
+    process on start instead of by a periodic task, which runs on one machine only.
+    Worker processes are replaced regularly (`worker_max_tasks_per_child`). Scratch
+    files are not needed longer than the task creating them (`task_time_limit`).
+    """
+    scratch.cleanup(celery.conf.task_time_limit)
+
+
+def load_ml_models():
+    """Load machine-learning models.
+
     Custom trained model for object detection (obj) and classification (cls) of
     markings and colors.
 
     Zero shot segment anything model (sam) for automatic mask generation.
+
+    Models are loaded for the configured inference backend (`ml_backend`).
     """
-    logging.info("Initialize ml-models.")
+    logging.info(f"Initialize ml-models (backend: {CONFIG.ml_backend}).")
     global sam_predictor
     global yolo_obj_osm
     global yolo_obj_esri
     global yolo_cls
 
-    path = init_sam2()
-    device = select_computation_device()
-    sam2_model = build_sam2(
-        config_file="sam2_hiera_b+.yaml",
-        ckpt_path=path,
-        device=device,
-    )
-    sam_predictor = SAM2ImagePredictor(sam2_model)
-
-    yolo_obj_osm = YOLO_MB(init_model(CONFIG.yolo_osm_obj))
-    yolo_obj_esri = YOLO_MB(init_model(CONFIG.yolo_esri_obj))
-    yolo_cls = YOLO(init_model(CONFIG.yolo_cls))
+    sam_predictor = init_sam_predictor()
+    yolo_obj_osm = init_yolo_obj(CONFIG.yolo_osm_obj)
+    yolo_obj_esri = init_yolo_obj(CONFIG.yolo_esri_obj)
+    yolo_cls = init_yolo_cls(CONFIG.yolo_cls)
 
 
 @worker_process_shutdown.connect
@@ -117,6 +204,8 @@ def generate_sketch_map(
         scale,
         layer,
     )
+    # precompute features of the map frame needed for clipping uploaded sketch maps
+    features = compute_template_features(to_array(map_img.getvalue())).to_bytes()
     db_client_celery.insert_map_frame(
         map_img,
         self.request.id,
@@ -125,6 +214,7 @@ def generate_sketch_map(
         format_,
         orientation,
         layer,
+        features,
     )
     return map_pdf
 
@@ -139,27 +229,52 @@ def digitize_sketches(
     layer: str,
     bbox: Bbox,
 ) -> FeatureCollection:
-    if layer == "osm":
-        yolo_obj = yolo_obj_osm
-    elif layer.startswith(("esri-world-imagery", "oam")):
-        yolo_obj = yolo_obj_esri
+    markings: list[NDArray]
+    if CONFIG.inference_server_address:
+        with stage("inference_server"):
+            markings = inference_client.detect_markings(
+                sketch_map_frame,
+                map_frame,
+                layer,
+            )
     else:
-        raise ValueError("Unexpected layer: " + layer)
-
-    markings: list[NDArray] = detect_markings(
-        sketch_map_frame,
-        map_frame,
-        yolo_obj,
-        yolo_cls,
-        sam_predictor,
-    )
+        if layer == "osm":
+            yolo_obj = yolo_obj_osm
+        elif layer.startswith(("esri-world-imagery", "oam")):
+            yolo_obj = yolo_obj_esri
+        else:
+            raise ValueError("Unexpected layer: " + layer)
+        markings = detect_markings(
+            sketch_map_frame,
+            map_frame,
+            yolo_obj,
+            yolo_cls,
+            sam_predictor,
+        )
     # m = marking
     l = []  # noqa: E741
-    for m in markings:
-        m: BytesIO = georeference(m, bbox, bgr=False)  # type: ignore
-        m: FeatureCollection = polygonize(m, layer_name=file_name)  # type: ignore
-        m: FeatureCollection = post_process(m, file_name, bbox)
-        l.append(m)
+    if CONFIG.polygonize_mode == "combined":
+        with stage("polygonize"):
+            fcs = polygonize_markings(markings, bbox, layer_name=file_name)
+        for m in fcs:
+            if len(m["features"]) == 0:
+                continue  # empty marking
+            with stage("post_process"):
+                m: FeatureCollection = post_process(m, file_name, bbox)
+            l.append(m)
+    else:
+        for m in markings:
+            with stage("georeference_markings"):
+                m, marking_bbox = crop_to_content(m, bbox)
+                m: BytesIO = georeference(m, marking_bbox, bgr=False)  # type: ignore
+            with stage("polygonize"):
+                m: FeatureCollection = polygonize(  # type: ignore
+                    m,
+                    layer_name=file_name,
+                )
+            with stage("post_process"):
+                m: FeatureCollection = post_process(m, file_name, bbox)
+            l.append(m)
     if len(l) == 0:
         raise MarkingDetectionError(
             N_(f"For '{file_name}' (ID: {file_id}) no markings have been detected.")
@@ -167,11 +282,12 @@ def digitize_sketches(
     return merge(l)
 
 
-@celery.task
+@celery.task(bind=True)
 def upload_processing(
+    self,
     file_id: int,
     file_name: str,
-    map_frame: NDArray,
+    uuid: str,
     layer: str,
     bbox: Bbox,
 ) -> (
@@ -179,28 +295,103 @@ def upload_processing(
     | tuple[
         str,
         str,
-        BytesIO,
+        BytesIO | Artifact | None,
         FeatureCollection,
         list,
     ]
 ):
-    """Georeference and digitize given sketch map."""
+    """Georeference and digitize given sketch map.
+
+    The map frame is passed by UUID and loaded by the worker (see `get_map_frame`).
+
+    If the scratch store is enabled (`scratch_dir`), the clipped sketch map frame is
+    a memory-mapped array (see `scratch`). If the artifact store is enabled
+    (`artifact_store_url`), the georeferenced sketch map frame is returned as
+    reference to an artifact (see `artifact_store`).
+
+    Expected errors (e.g. the sketch map could not be clipped or no markings could
+    be detected) are returned as list instead of being raised. If the sketch map
+    could not be clipped, no raster result (None) and no features are returned.
+
+    Wall time, CPU time and peak memory of each stage are recorded. While the task
+    is running, they are published as task metadata after each stage (see
+    `publish_stages`). Once the task has finished, they are exposed as custom
+    Celery event (`task-stages`) and as structured log line, but not as part of
+    the task result.
+    """
     errors = []
-    sketch_map_uploaded = db_client_celery.select_file(file_id)
-    sketch_map_frame = clip(to_array(sketch_map_uploaded), map_frame)
-    sketch_map_frame_georeferenced = georeference(sketch_map_frame, bbox)
-    try:
-        sketches = digitize_sketches(
-            file_id,
-            file_name,
-            map_frame,
-            sketch_map_frame,
-            layer,
-            bbox,
-        )
-    except MarkingDetectionError as error:
-        sketches = FeatureCollection(features=[])
-        errors.append(error)
+    with record_stages(callback=publish_stages(self)) as stages:
+        try:
+            with stage("map_frame"):
+                map_frame = get_map_frame(uuid)
+            with stage("fetch_file"):
+                sketch_map_uploaded = db_client_celery.select_file(file_id)
+            with stage("to_array"):
+                sketch_map_uploaded = to_array(sketch_map_uploaded)
+            with stage("template_features"):
+                template_features = get_template_features(uuid, map_frame)
+            with stage("clip"):
+                try:
+                    sketch_map_frame = clip(
+                        sketch_map_uploaded,
+                        map_frame,
+                        template_features,
+                        out=create_sketch_map_frame_array(
+                            sketch_map_uploaded,
+                            map_frame,
+                        ),
+                    )
+                except ClippingError:
+                    # fail early before running georeferencing and digitization.
+                    # The error is returned instead of raised: A failed task would
+                    # fail the chord and skip its callbacks (e.g. `cleanup_blobs`).
+                    errors.append(
+                        ClippingError(
+                            N_(
+                                "The sketch map '{FILE_NAME}' (ID: {ID}) could not "
+                                "be detected on the uploaded image. Please make sure "
+                                "that the whole map frame is visible and that the "
+                                "image is not blurry."
+                            ),
+                            {"FILE_NAME": file_name, "ID": file_id},
+                        )
+                    )
+                    return (
+                        file_name,
+                        get_attribution(layer),
+                        None,
+                        FeatureCollection(features=[]),
+                        errors,
+                    )
+            del sketch_map_uploaded  # free memory before digitization
+            with stage("georeference"):
+                sketch_map_frame_georeferenced = georeference_sketch_map_frame(
+                    sketch_map_frame,
+                    bbox,
+                    key="raster-results/{}.geotiff".format(self.request.id or uuid4()),
+                )
+            try:
+                sketches = digitize_sketches(
+                    file_id,
+                    file_name,
+                    map_frame,
+                    sketch_map_frame,
+                    layer,
+                    bbox,
+                )
+            except MarkingDetectionError as error:
+                sketches = FeatureCollection(features=[])
+                errors.append(error)
+        finally:
+            self.send_event("task-stages", stages=stages.to_dict())
+            log_stages(
+                stages,
+                task=self.name,
+                task_id=self.request.id,
+                hostname=self.request.hostname,
+                file_id=file_id,
+                map_frame_cache=map_frame_cache.stats(),
+            )
 
     attribution = get_attribution(layer)
     return (
@@ -212,10 +403,178 @@ def upload_processing(
     )
 
 
+def publish_stages(task, interval: float = 1.0) -> Callable[[Stages], None]:
+    """Create callback publishing recorded stages as task metadata (state `STARTED`).
+
+    Stages are published at most once per interval [s] to limit the number of
+    writes to the result backend (e.g. stages per marking).
+    """
+    last = -math.inf
+
+    def callback(stages: Stages):
+        nonlocal last
+        now = time.monotonic()
+        if now - last < interval:
+            return
+        last = now
+        task.update_state(state="STARTED", meta={"stages": stages.to_dict()})
+
+    return callback
+
+
+def create_sketch_map_frame_array(
+    sketch_map: NDArray,
+    map_frame: NDArray,
+) -> NDArray | None:
+    """Create a memory-mapped array for the clipped sketch map frame.
+
+    Returns None (array is allocated on the heap by `clip`) if the scratch store is
+    disabled.
+    """
+    if not scratch.is_enabled():
+        return None
+    shape = map_frame.shape[:2] + sketch_map.shape[2:]
+    return scratch.create_array(shape, sketch_map.dtype)
+
+
+def georeference_sketch_map_frame(
+    sketch_map_frame: NDArray,
+    bbox: Bbox,
+    key: str,
+) -> BytesIO | Artifact:
+    """Georeference sketch map frame.
+
+    If the artifact store is enabled, the GeoTIFF is written to a local file first
+    (in the scratch directory, if enabled) and then put into the artifact store
+    with given key. Otherwise it is returned as an in-memory buffer, which is
+    stored in the result backend.
+    """
+    if not artifact_store.is_enabled():
+        return georeference(sketch_map_frame, bbox)
+    return put_artifact(key, lambda path: write_geotiff(sketch_map_frame, bbox, path))
+
+
+def put_artifact(key: str, write: Callable[[str], None]) -> Artifact:
+    """Write a local file with given function and put it into the artifact store.
+
+    The local file is created in the scratch directory, if enabled.
+    """
+    suffix = os.path.splitext(key)[1]
+    if scratch.is_enabled():
+        path = scratch.create_file(suffix=suffix)
+    else:
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+    try:
+        write(path)
+        artifact_store.get_artifact_store().put(key, path)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return Artifact(key)
+
+
+def get_map_frame(uuid: str) -> NDArray:
+    """Get decoded map frame of the associated UUID.
+
+    Decoded map frames are cached per worker process, since uploads of a digitize
+    request are often of the same sketch map. The returned array is read-only.
+
+    Cached map frames are validated on access: If a map frame has been cleaned up
+    in the meantime (possibly by another worker process), it is evicted.
+    """
+    map_frame = map_frame_cache.get((uuid, "map_frame"))
+    if map_frame is not None:
+        if db_client_celery.select_map_frame_exists(UUID(uuid)):
+            return map_frame
+        evict_map_frame(uuid)
+    map_frame = to_array(db_client_celery.select_map_frame(UUID(uuid)))
+    map_frame.flags.writeable = False
+    map_frame_cache.put((uuid, "map_frame"), map_frame)
+    return map_frame
+
+
+def get_template_features(uuid: str, map_frame: NDArray) -> TemplateFeatures:
+    """Get precomputed features of the map frame needed for clipping.
+
+    Features of map frames generated before features were precomputed are computed
+    and stored on first use. Features are cached alongside the map frame and are
+    expected to be requested after `get_map_frame`, which validates the cache.
+    """
+    features = map_frame_cache.get((uuid, "features"))
+    if features is not None:
+        return features
+    raw = db_client_celery.select_map_frame_features(UUID(uuid))
+    if raw is not None:
+        features = TemplateFeatures.from_bytes(raw)
+    else:
+        features = compute_template_features(map_frame)
+        db_client_celery.update_map_frame_features(UUID(uuid), features.to_bytes())
+    map_frame_cache.put((uuid, "features"), features)
+    return features
+
+
+def evict_map_frame(uuid: str):
+    """Evict map frame and its features from the cache."""
+    map_frame_cache.pop((uuid, "map_frame"))
+    map_frame_cache.pop((uuid, "features"))
+
+
 @celery.task(ignore_result=True)
 def cleanup_map_frames():
     """Cleanup map frames stored in the database."""
-    db_client_celery.cleanup_map_frames()
+    for uuid in db_client_celery.cleanup_map_frames():
+        evict_map_frame(str(uuid))
+
+
+@celery.task(ignore_result=True)
+def cleanup_artifacts():
+    """Cleanup artifacts older than the results referencing them."""
+    if artifact_store.is_enabled():
+        artifact_store.get_artifact_store().cleanup(
+            celery.conf.result_expires.total_seconds()
+        )
+
+
+def get_download_key(uuid: str, type_: str) -> str:
+    """Get artifact key of the assembled download of digitize results."""
+    match type_:
+        case "raster-results":
+            return "downloads/{}.zip".format(uuid)
+        case "vector-results":
+            return "downloads/{}.geojson".format(uuid)
+        case _:
+            raise ValueError("Unexpected type: " + type_)
+
+
+@celery.task(ignore_result=True)
+def assemble_results(results: list, uuid: str):
+    """Assemble downloads of digitize results and put them into the artifact store.
+
+    Called once all tasks of the group (UUID) have succeeded. Downloads are served
+    from the artifact store instead of being assembled on each request. They
+    expire together with the results (see `cleanup_artifacts`).
+
+    Errors are logged only, since downloads can still be assembled on request.
+    """
+
+    def write_raster_results(path: str):
+        with open(path, "wb") as file:
+            for chunk in iter_zip([r[:-2] for r in results if r[2] is not None]):
+                file.write(chunk)
+
+    def write_vector_results(path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            geojson.dump(merge([r[-2] for r in results]), file)
+
+    for type_, write in (
+        ("raster-results", write_raster_results),
+        ("vector-results", write_vector_results),
+    ):
+        try:
+            put_artifact(get_download_key(uuid, type_), write)
+        except Exception:
+            logging.exception(f"Could not assemble {type_} of {uuid}.")
 
 
 @celery.task(ignore_result=True)
@@ -3,37 +3,266 @@ Functionality to cut a sketch map out of a photograph containing one,
 based on a matching template
 """
 
+from dataclasses import dataclass
+from io import BytesIO
+
 import cv2
 import numpy as np
 from numpy.typing import NDArray
 
+from sketch_map_tool.config import CONFIG
+from sketch_map_tool.exceptions import ClippingError
+from sketch_map_tool.helpers import N_
+
+
+@dataclass(frozen=True)
+class TemplateFeatures:
+    """Features of a template (map frame) needed to clip photos of it.
+
+    The template never changes after map generation. Hence, its features are
+    computed once and stored alongside the map frame in the database.
+
+    Attributes:
+        points: Positions of BRISK keypoints (Nx2)
+        descriptors: BRISK descriptors (NxD)
+        marker_ids: IDs of detected ArUco markers (M)
+        marker_corners: Corners of detected ArUco markers (Mx4x2)
+    """
+
+    points: NDArray
+    descriptors: NDArray
+    marker_ids: NDArray
+    marker_corners: NDArray
+
+    @property
+    def markers(self) -> dict[int, NDArray]:
+        return dict(zip(self.marker_ids.tolist(), self.marker_corners))
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.points.nbytes
+            + self.descriptors.nbytes
+            + self.marker_ids.nbytes
+            + self.marker_corners.nbytes
+        )
+
+    def to_bytes(self) -> bytes:
+        buffer = BytesIO()
+        np.savez(
+            buffer,
+            points=self.points,
+            descriptors=self.descriptors,
+            marker_ids=self.marker_ids,
+            marker_corners=self.marker_corners,
+        )
+        return buffer.getvalue()
 
-def clip(photo: NDArray, template: NDArray) -> NDArray:
+    @classmethod
+    def from_bytes(cls, buffer: bytes) -> "TemplateFeatures":
+        with np.load(BytesIO(buffer), allow_pickle=False) as data:
+            return cls(
+                points=data["points"],
+                descriptors=data["descriptors"],
+                marker_ids=data["marker_ids"],
+                marker_corners=data["marker_corners"],
+            )
+
+
+def compute_template_features(template: NDArray) -> TemplateFeatures:
+    """Compute BRISK features and detect ArUco markers of a template."""
+    template_gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+    kpts_, desc_ = cv2.BRISK_create().detectAndCompute(template_gray, None)
+    kpts, desc = limit_keypoints(kpts_, desc_)
+    markers = detect_aruco_markers(template)
+    return TemplateFeatures(
+        points=np.float32([k.pt for k in kpts]).reshape(-1, 2),
+        descriptors=desc if desc is not None else np.empty((0, 64), dtype=np.uint8),
+        marker_ids=np.array(list(markers.keys()), dtype=np.int32),
+        marker_corners=np.float32(list(markers.values())).reshape(-1, 4, 2),
+    )
+
+
+def clip(
+    photo: NDArray,
+    template: NDArray,
+    template_features: TemplateFeatures | None = None,
+    out: NDArray | None = None,
+) -> NDArray:
     """Clip out the map frame from the photo of the map using the original map frame.
 
-    Use the BRISK implementation in OpenCV to detect a map on a given
-    photo based on a given template with the map. The detected area of the
-    image is warped to have the same alignment as the template.
+    The homography between photo and template is computed from the ArUco markers
+    printed on each map frame (see `detect_aruco_markers`). If too few markers are
+    detected on the photo (`clip_min_aruco_markers`) the homography is computed
+    based on BRISK features instead (see `find_homography_brisk`).
 
-    Utilizes the FLANN (Fast Library for Approximate Nearest Neighbors)
-    algorithm for efficient
-    descriptor matching.
+    The detected area of the image is warped to have the same alignment as the
+    template.
+
+    Homographies are validated (see `estimate_homography` and
+    `is_plausible_homography`). If no valid homography is found a `ClippingError`
+    is raised.
 
     :param photo: Photograph of a sketch map
     :param template: Matching template of the sketch map
+    :param template_features: Precomputed features of the template.
+        Computed if not given.
+    :param out: Array to write the cutout to (e.g. a memory-mapped array).
+        Needs the height and width of the template and the channels and dtype of
+        the photo. Allocated if not given.
     :return: The resulting image (the cutout)
     """
-    brisk = cv2.BRISK_create()
+    if template_features is None:
+        template_features = compute_template_features(template)
+    homography_matrix = find_homography_aruco(photo, template_features)
+    # Get dimensions of template
+    height, width, _ = template.shape
+
+    if homography_matrix is None:
+        homography_matrix = find_homography_brisk(
+            photo,
+            template_features,
+            (width, height),
+        )
+    if homography_matrix is None or not is_plausible_homography(
+        homography_matrix,
+        (width, height),
+        photo.shape,
+    ):
+        raise ClippingError(
+            N_("The sketch map could not be detected on the uploaded image.")
+        )
+
+    return cv2.warpPerspective(photo, homography_matrix, (width, height), dst=out)
+
+
+def detect_aruco_markers(image: NDArray) -> dict[int, NDArray]:
+    """Detect ArUco markers printed on the map frame.
+
+    Eight markers of the dictionary DICT_4X4_50 (IDs 0-7) are printed at the
+    corners and the middle of the edges of each map frame
+    (see `generate_pdf.draw_markers`). Markers detected more than once are ignored.
+
+    :return: Mapping of marker IDs to marker corners (4x2 array)
+    """
+    dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+    detector = cv2.aruco.ArucoDetector(dictionary, cv2.aruco.DetectorParameters())
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    corners, ids, _ = detector.detectMarkers(gray)
+    if ids is None:
+        return {}
+    ids = ids.flatten().tolist()
+    return {
+        id: c.reshape(4, 2)
+        for id, c in zip(ids, corners)
+        if id < 8 and ids.count(id) == 1
+    }
+
+
+def find_homography_aruco(
+    photo: NDArray,
+    template_features: TemplateFeatures,
+) -> NDArray | None:
+    """Find homography matrix based on ArUco markers detected on photo and template.
+
+    :return: Homography matrix or None if too few markers are detected on both or
+        if the homography is not valid.
+    """
+    markers_photo = detect_aruco_markers(photo)
+    if len(markers_photo) < CONFIG.clip_min_aruco_markers:
+        return None
+    markers_template = template_features.markers
+    ids = sorted(markers_photo.keys() & markers_template.keys())
+    if len(ids) < CONFIG.clip_min_aruco_markers:
+        return None
+    src_pts = np.float32([markers_photo[i] for i in ids]).reshape(-1, 1, 2)
+    dst_pts = np.float32([markers_template[i] for i in ids]).reshape(-1, 1, 2)
+    return estimate_homography(src_pts, dst_pts)
+
+
+def find_homography_brisk(
+    photo: NDArray,
+    template_features: TemplateFeatures,
+    template_size: tuple[int, int],
+) -> NDArray | None:
+    """Find homography matrix based on BRISK features of photo and template.
+
+    Use the BRISK implementation in OpenCV to detect a map on a given
+    photo based on a given template with the map.
+
+    If configured (`clip_coarse_max_side`), large photos are matched coarse-to-fine:
+    The homography is first estimated on a downscaled photo. It is then refined on
+    keypoints of the full resolution photo, which lie inside of the predicted map
+    frame and whose matches are close to their predicted position in the template.
+    Disabled by default: Keypoints are still detected on the whole photo in full
+    resolution (the mask only filters them), hence the refinement costs more than
+    the coarse matching saves (see `tests/benchmark/bench_clip.py`).
 
-    # Convert images to grayscale
+    Random number generators (keypoint selection, RANSAC) are seeded (`clip_seed`)
+    for deterministic results.
+
+    :param template_size: Width and height of the template
+    :return: Homography matrix or None if no valid homography is found.
+    """
+    cv2.setRNGSeed(CONFIG.clip_seed)
     photo_gray = cv2.cvtColor(photo, cv2.COLOR_BGR2GRAY)
-    template_gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+    max_side = CONFIG.clip_coarse_max_side
+    if max_side <= 0 or max(photo_gray.shape) <= max_side:
+        return match_brisk(photo_gray, template_features)
+
+    scale = max_side / max(photo_gray.shape)
+    photo_coarse = cv2.resize(
+        photo_gray,
+        None,
+        fx=scale,
+        fy=scale,
+        interpolation=cv2.INTER_AREA,
+    )
+    homography_coarse = match_brisk(photo_coarse, template_features)
+    if homography_coarse is None:
+        return match_brisk(photo_gray, template_features)
+    # homography of the downscaled photo to the photo in full resolution
+    homography_coarse = homography_coarse @ np.diag([scale, scale, 1])
+
+    mask = predict_map_frame_mask(homography_coarse, template_size, photo_gray.shape)
+    homography_fine = match_brisk(
+        photo_gray,
+        template_features,
+        mask=mask,
+        prior=homography_coarse,
+        max_distance=0.02 * max(template_size),
+    )
+    if homography_fine is None:
+        return homography_coarse
+    return homography_fine
+
+
+def match_brisk(
+    photo_gray: NDArray,
+    template_features: TemplateFeatures,
+    mask: NDArray | None = None,
+    prior: NDArray | None = None,
+    max_distance: float = 0,
+) -> NDArray | None:
+    """Match BRISK features of a (grayscale) photo to the features of a template.
+
+    Utilizes the FLANN (Fast Library for Approximate Nearest Neighbors)
+    algorithm for efficient
+    descriptor matching.
+
+    :param mask: Detect keypoints only inside of mask
+    :param prior: Prior homography. Only keep matches whose template points are
+        closer than `max_distance` to their position predicted by the prior.
+    :return: Homography matrix or None if too few matches are found.
+    """
+    brisk = cv2.BRISK_create()
 
     # Detect keypoints and compute descriptors
-    kpts1_, desc1_ = brisk.detectAndCompute(photo_gray, None)
-    kpts2_, desc2_ = brisk.detectAndCompute(template_gray, None)
+    kpts1_, desc1_ = brisk.detectAndCompute(photo_gray, mask)
+    if desc1_ is None:
+        return None
     kpts1, desc1 = limit_keypoints(kpts1_, desc1_)
-    kpts2, desc2 = limit_keypoints(kpts2_, desc2_)
+    pts2, desc2 = template_features.points, template_features.descriptors
 
     # FLANN parameters
     flann_params = {
@@ -58,19 +287,115 @@ def clip(photo: NDArray, template: NDArray) -> NDArray:
 
     # Extract corresponding points
     src_pts = np.float32([kpts1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-    dst_pts = np.float32([kpts2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+    dst_pts = np.float32([pts2[m.trainIdx] for m in good_matches]).reshape(-1, 1, 2)
+
+    if prior is not None and len(src_pts) > 0:
+        predicted = cv2.perspectiveTransform(src_pts, prior)
+        close = np.linalg.norm(predicted - dst_pts, axis=2).flatten() < max_distance
+        src_pts, dst_pts = src_pts[close], dst_pts[close]
+
+    return estimate_homography(src_pts, dst_pts)
 
-    # Find homography matrix
-    homography_matrix, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC)
-    # Get dimensions of template
-    height, width, _ = template.shape
 
-    # TODO: fix issue demonstrated by the test case
-    # `test_failed_georeferencing` in `test_clip.py`,
-    # then check success before return clipped img.
-    # succeed = filter_matrix(homography_matrix)
+def estimate_homography(src_pts: NDArray, dst_pts: NDArray) -> NDArray | None:
+    """Estimate homography matrix using RANSAC and validate its quality.
 
-    return cv2.warpPerspective(photo, homography_matrix, (width, height))
+    A homography is rejected if it is supported by too few inliers
+    (`clip_min_inliers`, `clip_min_inlier_ratio`) or if the reprojection error of
+    the inliers is too large (`clip_max_reprojection_error`).
+
+    :return: Homography matrix or None if rejected.
+    """
+    if len(src_pts) < max(4, CONFIG.clip_min_inliers):
+        return None
+    homography_matrix, mask = cv2.findHomography(
+        src_pts,
+        dst_pts,
+        cv2.RANSAC,
+        ransacReprojThreshold=5.0,
+    )
+    if homography_matrix is None:
+        return None
+    inliers = mask.ravel().astype(bool)
+    if (
+        inliers.sum() < CONFIG.clip_min_inliers
+        or inliers.mean() < CONFIG.clip_min_inlier_ratio
+    ):
+        return None
+    projected = cv2.perspectiveTransform(src_pts[inliers], homography_matrix)
+    error = np.sqrt(np.mean(np.sum((projected - dst_pts[inliers]) ** 2, axis=2)))
+    if error > CONFIG.clip_max_reprojection_error:
+        return None
+    return homography_matrix
+
+
+def is_plausible_homography(
+    homography_matrix: NDArray,
+    template_size: tuple[int, int],
+    shape: tuple[int, ...],
+) -> bool:
+    """Check if the map frame predicted by the homography is plausible.
+
+    The corners of the template are projected onto the photo. The resulting
+    quadrilateral has to be convex, cover a minimal area of the photo
+    (`clip_min_area`) and lie (roughly) inside the photo. The homography has to be
+    well-conditioned (`clip_max_condition`), i.e. the map frame is not squeezed
+    along one axis.
+    """
+    try:
+        inverse = np.linalg.inv(homography_matrix)
+    except np.linalg.LinAlgError:
+        return False
+    width, height = template_size
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    # points behind the camera (w <= 0) are not projected correctly
+    w = (np.c_[corners, np.ones(4)] @ inverse.T)[:, 2]
+    if not ((w > 0).all() or (w < 0).all()):
+        return False
+    corners = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), inverse)
+    if not cv2.isContourConvex(corners.astype(np.float32)):
+        return False
+
+    photo_height, photo_width = shape[:2]
+    area = cv2.contourArea(corners.astype(np.float32))
+    if area < CONFIG.clip_min_area * photo_width * photo_height:
+        return False
+    tolerance = 0.25 * max(photo_width, photo_height)
+    x, y = corners.reshape(-1, 2).T
+    if (
+        x.min() < -tolerance
+        or y.min() < -tolerance
+        or x.max() > photo_width + tolerance
+        or y.max() > photo_height + tolerance
+    ):
+        return False
+
+    affine = homography_matrix[:2, :2] / homography_matrix[2, 2]
+    return bool(np.linalg.cond(affine) <= CONFIG.clip_max_condition)
+
+
+def predict_map_frame_mask(
+    homography_matrix: NDArray,
+    template_size: tuple[int, int],
+    shape: tuple[int, ...],
+    padding: float = 0.05,
+) -> NDArray:
+    """Mask of the area of the photo showing the map frame (padded).
+
+    The corners of the template are projected onto the photo using the inverse of
+    the homography matrix.
+    """
+    width, height = template_size
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    corners = cv2.perspectiveTransform(
+        corners.reshape(-1, 1, 2),
+        np.linalg.inv(homography_matrix),
+    ).reshape(-1, 2)
+    center = corners.mean(axis=0)
+    corners = center + (corners - center) * (1 + padding)
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    cv2.fillConvexPoly(mask, np.round(corners).astype(np.int32), 255)
+    return mask
 
 
 def limit_keypoints(
@@ -81,21 +406,13 @@ def limit_keypoints(
     """Limit the number of keypoints and descriptors.
 
     This adressess the issue described in #403.
+    Keypoints are selected randomly. The random number generator is seeded
+    (`clip_seed`) for deterministic results.
     """
     if len(keypoints) > max_keypoints:
         # randomly select max_keypoints
-        indices = np.random.choice(len(keypoints), max_keypoints, replace=False)
+        rng = np.random.default_rng(CONFIG.clip_seed)
+        indices = rng.choice(len(keypoints), max_keypoints, replace=False)
         keypoints = [keypoints[i] for i in indices]
         descriptors = descriptors[indices]
     return keypoints, descriptors
-
-
-def filter_matrix(tran_matrix: NDArray) -> bool:
-    """Filters a failed transformation matrix based on specified conditions."""
-    h13 = tran_matrix[0, 2]
-    h23 = tran_matrix[1, 2]
-
-    if h13 > 1500 and h23 > 0:
-        return False
-    else:
-        return True
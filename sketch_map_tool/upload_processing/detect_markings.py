@@ -7,6 +7,9 @@ from sam2.sam2_image_predictor import SAM2ImagePredictor
 from ultralytics import YOLO
 from ultralytics_MB import YOLO as YOLO_MB
 
+from sketch_map_tool.config import CONFIG
+from sketch_map_tool.instrumentation import stage
+
 
 def detect_markings(
     sketch_map_frame: NDArray,
@@ -42,8 +45,11 @@ def detect_markings(
         yolo_cls,
         sam_predictor,
     )
+    if len(masks) == 0:
+        return []
     colors = [int(c) + 1 for c in colors]  # +1 because 0 is background
-    processed_markings = post_process(masks, bboxes, colors)
+    with stage("post_process_masks"):
+        processed_markings = post_process(masks, bboxes, colors)
     return processed_markings
 
 
@@ -66,10 +72,18 @@ def apply_ml_pipeline(
             Masks are binary numpy arrays with same dimensions as input image
             (map frame), masking the dominant segment inside of a bbox detected by YOLO.
             Class labels are colors.
+
+    If no objects are detected, classification and SAM (incl. the expensive image
+    encoding) are skipped.
     """
-    bounding_boxes, _ = apply_yolo_object_detection(image, map_frame, yolo_obj)
-    colors = apply_yolo_classification(image, bounding_boxes, yolo_cls)
-    masks, _ = apply_sam(image, bounding_boxes, sam_predictor)
+    with stage("yolo_detection"):
+        bounding_boxes, _ = apply_yolo_object_detection(image, map_frame, yolo_obj)
+    if len(bounding_boxes) == 0:
+        return [], bounding_boxes, []
+    with stage("yolo_classification"):
+        colors = apply_yolo_classification(image, bounding_boxes, yolo_cls)
+    with stage("sam"):
+        masks, _ = apply_sam(image, bounding_boxes, sam_predictor)
     return masks, bounding_boxes, colors
 
 
@@ -100,16 +114,24 @@ def apply_yolo_classification(
     to detect marking characteristics
     (color, marking_type).
 
+    All bounding box level images are classified in batches to reduce the number of
+    model invocations. The batch size is configurable (`yolo_cls_batch_size`) to
+    trade latency against memory consumption.
+
     Returns: list of labels predicted by the model.
     """
-    labels = []
-    img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    batch_size = CONFIG.yolo_cls_batch_size
+    img = np.array(image)
+    crops = []
     for b in bounding_boxes:
         x_min, y_min, x_max, y_max = [int(i) for i in b[:4]]
-        cropped_image = img[y_min:y_max, x_min:x_max]
-        res = yolo(Image.fromarray(cv2.cvtColor(cropped_image, cv2.COLOR_BGR2RGB)))
+        crops.append(Image.fromarray(img[y_min:y_max, x_min:x_max]))
+
+    labels = []
+    for i in range(0, len(crops), batch_size):
+        results = yolo(crops[i : i + batch_size])
         # get names from the model and label append to the list
-        labels.append(res[0].probs.top1)
+        labels.extend(r.probs.top1 for r in results)
     return labels
 
 
@@ -123,32 +145,154 @@ def apply_sam(
     Creates masks (numpy arrays) based on image segmentation and bounding boxes from
     object detection (YOLO).
 
+    All bounding boxes are decoded in batches (`sam_batch_size`) instead of one
+    predictor call per bounding box.
+
+    If configured (`sam_encoding = "roi"`) only regions of interest around clusters
+    of bounding boxes are encoded instead of the whole image (see `apply_sam_roi`).
+    Each region costs one pass of the image encoder (SAM resizes every image to the
+    same input size). Hence, the whole image is encoded instead if there are more
+    regions than `sam_roi_max_regions` or if they cover more than
+    `sam_roi_max_area` of the image.
+
     Returns:
         tuple: List of masks and corresponding scores.
     """
+    if CONFIG.sam_encoding == "roi":
+        regions = cluster_bounding_boxes(bounding_boxes, image.size)
+        area = sum((x1 - x0) * (y1 - y0) for (x0, y0, x1, y1), _ in regions)
+        if (
+            len(regions) <= CONFIG.sam_roi_max_regions
+            and area <= CONFIG.sam_roi_max_area * image.size[0] * image.size[1]
+        ):
+            return apply_sam_roi(image, bounding_boxes, regions, sam_predictor)
     with torch.inference_mode(), torch.autocast("cuda", dtype=torch.bfloat16):
         sam_predictor.set_image(np.array(image))
-        masks = []
-        scores = []
-        for bbox in bounding_boxes:
-            mask, score = mask_from_bbox(bbox, sam_predictor)
-            masks.append(mask)
-            scores.append(score)
+        return predict_masks(bounding_boxes, sam_predictor)
+
+
+def apply_sam_roi(
+    image: Image.Image,
+    bounding_boxes: NDArray,
+    regions: list[tuple[tuple[int, int, int, int], list[int]]],
+    sam_predictor: SAM2ImagePredictor,
+) -> tuple[list[NDArray], list[np.float32]]:
+    """Apply SAM on regions of interest of an image.
+
+    Each region is encoded separately. Masks are stitched back into the coordinates
+    of the whole image as boolean arrays.
+
+    For large, high-resolution images with few markings this saves memory and time:
+    masks predicted by SAM have the size of the encoded region (as float32) instead
+    of the size of the whole image.
+    """
+    img = np.array(image)
+    height, width = img.shape[:2]
+    masks: list = [None] * len(bounding_boxes)
+    scores: list = [None] * len(bounding_boxes)
+    with torch.inference_mode(), torch.autocast("cuda", dtype=torch.bfloat16):
+        for (x0, y0, x1, y1), indexes in regions:
+            sam_predictor.set_image(img[y0:y1, x0:x1])
+            bboxes = np.asarray(bounding_boxes)[indexes, :4] - [x0, y0, x0, y0]
+            masks_, scores_ = predict_masks(bboxes, sam_predictor)
+            for i, mask, score in zip(indexes, masks_, scores_):
+                masks[i] = np.zeros((height, width), dtype=bool)
+                masks[i][y0:y1, x0:x1] = mask > 0
+                scores[i] = score
+    return masks, scores
+
+
+def cluster_bounding_boxes(
+    bounding_boxes: NDArray,
+    size: tuple[int, int],
+) -> list[tuple[tuple[int, int, int, int], list[int]]]:
+    """Cluster padded bounding boxes into non-overlapping regions of interest.
+
+    Bounding boxes are padded (`sam_roi_padding`) to give SAM context around a
+    marking. Overlapping padded bounding boxes are merged into one region.
+
+    Parameters:
+    bounding_boxes: Bounding boxes (x_min, y_min, x_max, y_max).
+    size: Size of the image (width, height).
+
+    Returns: List of regions (x_min, y_min, x_max, y_max) and the indexes of the
+        bounding boxes inside each region.
+    """
+    width, height = size
+    regions = []
+    for i, (x0, y0, x1, y1) in enumerate(np.asarray(bounding_boxes)[:, :4]):
+        padding = max(16, CONFIG.sam_roi_padding * max(x1 - x0, y1 - y0))
+        region = (
+            max(0, int(x0 - padding)),
+            max(0, int(y0 - padding)),
+            min(width, int(np.ceil(x1 + padding))),
+            min(height, int(np.ceil(y1 + padding))),
+        )
+        regions.append((region, [i]))
+
+    # merge overlapping regions until all regions are disjoint
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                (a, indexes_a), (b, indexes_b) = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    union = (
+                        min(a[0], b[0]),
+                        min(a[1], b[1]),
+                        max(a[2], b[2]),
+                        max(a[3], b[3]),
+                    )
+                    regions[i] = (union, indexes_a + indexes_b)
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+
+def predict_masks(
+    bounding_boxes: NDArray,
+    sam_predictor: SAM2ImagePredictor,
+) -> tuple[list[NDArray], list[np.float32]]:
+    """Predict masks for bounding boxes in batches (`sam_batch_size`).
+
+    The image has to be set on the predictor beforehand.
+    """
+    batch_size = CONFIG.sam_batch_size
+    masks = []
+    scores = []
+    for i in range(0, len(bounding_boxes), batch_size):
+        masks_, scores_ = masks_from_bboxes(
+            bounding_boxes[i : i + batch_size],
+            sam_predictor,
+        )
+        masks.extend(masks_)
+        scores.extend(scores_)
     return masks, scores
 
 
-def mask_from_bbox(
-    bbox: NDArray,
+def masks_from_bboxes(
+    bboxes: NDArray,
     sam_predictor: SAM2ImagePredictor,
-) -> tuple:
-    """Generate a mask using SAM (Segment Anything) predictor for a given bounding box.
+) -> tuple[list[NDArray], list[np.float32]]:
+    """Generate masks using SAM (Segment Anything) predictor for given bounding boxes.
+
+    The predictor is prompted with all bounding boxes at once. One mask is generated
+    per bounding box (no multimask output).
 
     Returns:
-        tuple: Mask and corresponding score.
+        tuple: List of masks and corresponding scores.
     """
-    masks, scores, _ = sam_predictor.predict(box=bbox, multimask_output=False)
-    # TODO: should error be raised if lists has more then one element?
-    return masks[0], scores[0]
+    bboxes = np.asarray(bboxes)[:, :4]
+    masks, scores, _ = sam_predictor.predict(box=bboxes, multimask_output=False)
+    # For a single bounding box the batch dimension is squeezed by SAM:
+    # (1, H, W) instead of (B, 1, H, W)
+    masks = masks.reshape(len(bboxes), -1, *masks.shape[-2:])[:, 0]
+    scores = scores.reshape(len(bboxes), -1)[:, 0]
+    return list(masks), list(scores)
 
 
 def create_marking_array(
@@ -170,6 +314,8 @@ def post_process(
 
     Apply morphological operations to clean the masks, creates contours and fills them.
     """
+    if len(masks) == 0:
+        return []
     # Convert and preprocess masks
     preprocessed_masks = np.array([np.vstack(mask) for mask in masks], dtype=np.float32)
     preprocessed_masks[preprocessed_masks == 0] = np.nan
@@ -1,8 +1,8 @@
 from io import BytesIO
-from pathlib import Path
-from tempfile import TemporaryDirectory
+from uuid import uuid4
 
 import cv2
+import numpy as np
 from numpy.typing import NDArray
 from osgeo import gdal, osr
 
@@ -18,24 +18,35 @@ def georeference(img: NDArray, bbox: Bbox, bgr: bool = True) -> BytesIO:
 
     The Bounding Box is in WGS 84 / Pseudo-Mercator.
     """
+    # write GeoTIFF to GDAL's in-memory filesystem (no disk round trips)
+    path = "/vsimem/georeference-{}.geotiff".format(uuid4())
+    try:
+        write_geotiff(img, bbox, path, bgr=bgr)
+        return BytesIO(read_vsimem(path))
+    finally:
+        if gdal.VSIStatL(path) is not None:
+            gdal.Unlink(path)
+
+
+def write_geotiff(img: NDArray, bbox: Bbox, path: str, bgr: bool = True):
+    """Write a GeoTIFF of an image and bounding box coordinates to given path.
+
+    See `georeference`.
+    """
     gdal.UseExceptions()
 
     width = img.shape[1]
     height = img.shape[0]
-    pixel_width = abs(bbox.lon_max - bbox.lon_min) / width
-    pixel_height = abs(bbox.lat_max - bbox.lat_min) / height
-
-    with TemporaryDirectory() as tmpdirname:
-        outfile_name = Path(tmpdirname) / "out.geotiff"
-        # create dataset (destination raster)
-        dataset = gdal.GetDriverByName("GTiff").Create(
-            str(outfile_name),
-            width,
-            height,
-            3 if bgr else 1,
-            gdal.GDT_Byte,
-        )
 
+    # create dataset (destination raster)
+    dataset = gdal.GetDriverByName("GTiff").Create(
+        path,
+        width,
+        height,
+        3 if bgr else 1,
+        gdal.GDT_Byte,
+    )
+    try:
         if bgr:
             # write numpy array to destination raster in RGB (Reverse GBR image)
             dataset.GetRasterBand(1).WriteArray(img[:, :, 2])  # Red
@@ -44,27 +55,78 @@ def georeference(img: NDArray, bbox: Bbox, bgr: bool = True) -> BytesIO:
         else:
             dataset.GetRasterBand(1).WriteArray(img)  # color value
 
-        # set geo transform
-        # fmt: off
-        transform = [
-            bbox.lon_min,   # x-coordinate of upper-left corner of upper-left pixel
-            pixel_width,
-            0,              # row rotation (typically zero)
-            bbox.lat_max,   # y-coordinate of upper-left corner of upper-left pixel
-            0,              # column rotation (typically zero)
-            -pixel_height,  # negative value for a north-up image
-        ]
-        # fmt: on
-        dataset.SetGeoTransform(transform)
-
-        # set spatial reference system
-        spatial_reference_system = osr.SpatialReference()
-        spatial_reference_system.ImportFromEPSG(3857)  # WGS 84 / Pseudo-Mercator
-        dataset.SetProjection(spatial_reference_system.ExportToWkt())
-
+        dataset.SetGeoTransform(get_geotransform(bbox, width, height))
+        dataset.SetProjection(get_projection())
+    finally:
         dataset = None  # close dataset
-        with open(outfile_name, "rb") as f:
-            return BytesIO(f.read())
+
+
+def crop_to_content(img: NDArray, bbox: Bbox) -> tuple[NDArray, Bbox]:
+    """Crop image (e.g. a marking) to the bounding rectangle of its non-zero pixels.
+
+    Returns the cropped image and the bounding box of the crop, which is offset to
+    the origin of the crop. An image without any non-zero pixels is not cropped.
+    """
+    rect = get_bounding_rect(img)
+    if rect is None:
+        return img, bbox
+    x0, y0, x1, y1 = rect
+    height, width = img.shape[:2]
+    pixel_width = (bbox.lon_max - bbox.lon_min) / width
+    pixel_height = (bbox.lat_max - bbox.lat_min) / height
+    cropped_bbox = Bbox(
+        lon_min=bbox.lon_min + x0 * pixel_width,
+        lat_min=bbox.lat_max - y1 * pixel_height,
+        lon_max=bbox.lon_min + x1 * pixel_width,
+        lat_max=bbox.lat_max - y0 * pixel_height,
+    )
+    return img[y0:y1, x0:x1], cropped_bbox
+
+
+def get_bounding_rect(img: NDArray) -> tuple[int, int, int, int] | None:
+    """Get bounding rectangle (x0, y0, x1, y1) of non-zero pixels (exclusive end).
+
+    Returns None if image has no non-zero pixels.
+    """
+    mask = img if img.ndim == 2 else img.any(axis=2)
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def get_geotransform(bbox: Bbox, width: int, height: int) -> list[float]:
+    """Get geo transform of a raster of given size covering the bounding box."""
+    pixel_width = abs(bbox.lon_max - bbox.lon_min) / width
+    pixel_height = abs(bbox.lat_max - bbox.lat_min) / height
+    # fmt: off
+    return [
+        bbox.lon_min,   # x-coordinate of upper-left corner of upper-left pixel
+        pixel_width,
+        0,              # row rotation (typically zero)
+        bbox.lat_max,   # y-coordinate of upper-left corner of upper-left pixel
+        0,              # column rotation (typically zero)
+        -pixel_height,  # negative value for a north-up image
+    ]
+    # fmt: on
+
+
+def get_projection() -> str:
+    """Get WKT of the spatial reference system WGS 84 / Pseudo-Mercator."""
+    spatial_reference_system = osr.SpatialReference()
+    spatial_reference_system.ImportFromEPSG(3857)
+    return spatial_reference_system.ExportToWkt()
+
+
+def read_vsimem(path: str) -> bytes:
+    """Read file from GDAL's in-memory filesystem (`/vsimem/`)."""
+    size = gdal.VSIStatL(path).size
+    file = gdal.VSIFOpenL(path, "rb")
+    try:
+        return bytes(gdal.VSIFReadL(1, size, file))
+    finally:
+        gdal.VSIFCloseL(file)
 
 
 def print_copyright_note(img: NDArray) -> NDArray:
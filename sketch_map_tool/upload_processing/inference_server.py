@@ -0,0 +1,340 @@
+"""Local inference server holding one copy of the machine-learning models.
+
+Celery workers send requests to the inference server over a Unix socket
+(configuration `inference_server_address`) instead of running the models
+in-process. This decouples the concurrency of CPU-heavy inference from the number of
+Celery worker processes.
+
+Messages are pickled. Hence, the socket is only accessible by its owner and
+connections are authenticated with a shared key (`inference_server_authkey`).
+
+Run the server with:
+    python -m sketch_map_tool.upload_processing.inference_server
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Callable
+
+import numpy as np
+from numpy.typing import NDArray
+
+from sketch_map_tool.config import CONFIG
+from sketch_map_tool.upload_processing.detect_markings import detect_markings
+from sketch_map_tool.upload_processing.ml_models import (
+    clone_sam_predictor,
+    init_sam_predictor,
+    init_yolo_cls,
+    init_yolo_obj,
+)
+
+
+class MicroBatcher:
+    """Collect items submitted by concurrent threads and process them in batches.
+
+    Items arriving within a short time window (`max_wait` in seconds) are
+    processed together by one call of `func` (up to `max_batch_size` items).
+    `func` is expected to take a list of items and to return a list of results in
+    the same order.
+
+    If `func` fails on a batch, the items are processed one by one. Only
+    submissions of failing items fail.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[list], list],
+        max_batch_size: int,
+        max_wait: float,
+    ):
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, items: list) -> list:
+        """Submit items and wait for their results."""
+        futures = []
+        for item in items:
+            future = Future()
+            self.queue.put((item, future))
+            futures.append(future)
+        return [f.result() for f in futures]
+
+    def _next_batch(self) -> list[tuple]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            items, futures = zip(*self._next_batch())
+            self._process(list(items), list(futures))
+
+    def _process(self, items: list, futures: list[Future]):
+        try:
+            results = self.func(items)
+        except Exception as error:
+            if len(items) == 1:
+                futures[0].set_exception(error)
+                return
+            for item, future in zip(items, futures):
+                self._process([item], [future])
+        else:
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+
+class BatchedModel:
+    """Proxy of an YOLO model batching predictions of concurrent threads.
+
+    Only the thread of the batcher calls the model. (Ultralytics models are not
+    thread-safe.)
+    """
+
+    def __init__(self, model, max_batch_size: int, max_wait: float):
+        self.batcher = MicroBatcher(model, max_batch_size, max_wait)
+
+    def predict(self, source) -> list:
+        if not isinstance(source, list):
+            source = [source]
+        return self.batcher.submit(source)
+
+    __call__ = predict
+
+
+class BoundedSamPredictor:
+    """Proxy of a SAM predictor limiting the number of threads running SAM at once.
+
+    Predictors of all threads share the same model and the thread pool of the
+    inference backend. Running SAM in too many threads at once oversubscribes
+    the CPU.
+    """
+
+    def __init__(self, sam_predictor, semaphore: threading.BoundedSemaphore):
+        self.sam_predictor = sam_predictor
+        self.semaphore = semaphore
+
+    def set_image(self, *args, **kwargs):
+        with self.semaphore:
+            return self.sam_predictor.set_image(*args, **kwargs)
+
+    def predict(self, *args, **kwargs):
+        with self.semaphore:
+            return self.sam_predictor.predict(*args, **kwargs)
+
+
+class InferenceServer:
+    """Serve requests for marking detection over a Unix socket.
+
+    Each connection (one per Celery worker process) is handled by its own thread.
+    Object detection requests (per layer) and classification requests of
+    concurrent detections are batched. SAM (image encoding and mask prediction) is
+    run by at most `inference_server_threads` threads at once.
+
+    The SAM predictor is stateful (image embeddings). Each thread uses its own
+    predictor sharing the same model.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        sam_predictor,
+        yolo_obj_osm,
+        yolo_obj_esri,
+        yolo_cls,
+    ):
+        self.address = address
+        self.sam_predictor = sam_predictor
+        self.semaphore = threading.BoundedSemaphore(CONFIG.inference_server_threads)
+        self.local = threading.local()
+        self.yolo_obj_osm = BatchedModel(
+            yolo_obj_osm,
+            CONFIG.yolo_obj_batch_size,
+            CONFIG.inference_server_batch_wait,
+        )
+        self.yolo_obj_esri = BatchedModel(
+            yolo_obj_esri,
+            CONFIG.yolo_obj_batch_size,
+            CONFIG.inference_server_batch_wait,
+        )
+        self.yolo_cls = BatchedModel(
+            yolo_cls,
+            CONFIG.yolo_cls_batch_size,
+            CONFIG.inference_server_batch_wait,
+        )
+
+    def serve_forever(self):
+        authkey = get_authkey()
+        if os.path.exists(self.address):
+            os.remove(self.address)  # remove stale socket
+        # socket is created with mode 0600 (accessible by owner only) on bind
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(umask)
+        with listener:
+            logging.info(f"Inference server listening on {self.address}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except AuthenticationError:
+                    logging.warning("Rejected connection with invalid authkey.")
+                    continue
+                threading.Thread(
+                    target=self.handle,
+                    args=(connection,),
+                    daemon=True,
+                ).start()
+
+    def handle(self, connection: Connection):
+        with connection:
+            while True:
+                try:
+                    method, args = connection.recv()
+                except EOFError:
+                    break
+                try:
+                    if method != "detect_markings":
+                        raise ValueError("Unexpected method: " + method)
+                    response = ("ok", self.detect_markings(*args))
+                except Exception as error:
+                    logging.exception(error)
+                    response = ("error", error)
+                try:
+                    connection.send(response)
+                except OSError:
+                    break  # client is gone (e.g. timed out)
+
+    def detect_markings(
+        self,
+        sketch_map_frame: NDArray,
+        map_frame: NDArray,
+        layer: str,
+    ) -> list[tuple]:
+        if layer == "osm":
+            yolo_obj = self.yolo_obj_osm
+        elif layer.startswith(("esri-world-imagery", "oam")):
+            yolo_obj = self.yolo_obj_esri
+        else:
+            raise ValueError("Unexpected layer: " + layer)
+        if not hasattr(self.local, "sam_predictor"):
+            self.local.sam_predictor = BoundedSamPredictor(
+                clone_sam_predictor(self.sam_predictor),
+                self.semaphore,
+            )
+        markings = detect_markings(
+            sketch_map_frame,
+            map_frame,
+            yolo_obj,  # type: ignore
+            self.yolo_cls,  # type: ignore
+            self.local.sam_predictor,
+        )
+        return [pack_marking(m) for m in markings]
+
+
+class InferenceClient:
+    """Client of the inference server used by Celery worker processes.
+
+    The connection is opened on first request and reused afterwards. If the server
+    does not respond within `inference_server_timeout` seconds a `TimeoutError` is
+    raised.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.connection: Connection | None = None
+
+    def detect_markings(
+        self,
+        sketch_map_frame: NDArray,
+        map_frame: NDArray,
+        layer: str,
+    ) -> list[NDArray]:
+        """Detect markings using the inference server.
+
+        See `detect_markings.detect_markings` for details.
+        """
+        response = self._request("detect_markings", sketch_map_frame, map_frame, layer)
+        return [unpack_marking(*m) for m in response]
+
+    def _request(self, method: str, *args):
+        if self.connection is None:
+            self.connection = Client(
+                self.address,
+                family="AF_UNIX",
+                authkey=get_authkey(),
+            )
+        try:
+            self.connection.send((method, args))
+            if not self.connection.poll(CONFIG.inference_server_timeout):
+                # TimeoutError is an OSError: A late response is dropped as well
+                raise TimeoutError(
+                    "Inference server did not respond within "
+                    + f"{CONFIG.inference_server_timeout} seconds."
+                )
+            status, result = self.connection.recv()
+        except (EOFError, OSError):
+            self.connection.close()
+            self.connection = None  # reconnect on next request
+            raise
+        if status == "error":
+            raise result
+        return result
+
+
+def get_authkey() -> bytes:
+    """Get key to authenticate connections between inference server and clients."""
+    if not CONFIG.inference_server_authkey:
+        raise ValueError(
+            "An authentication key (`inference_server_authkey`) is required to "
+            + "use the inference server."
+        )
+    return CONFIG.inference_server_authkey.encode()
+
+
+def pack_marking(marking: NDArray) -> tuple[NDArray, tuple, int]:
+    """Pack single color marking array into bits to reduce the size of messages."""
+    return np.packbits(marking > 0), marking.shape, int(marking.max(initial=0))
+
+
+def unpack_marking(bits: NDArray, shape: tuple, color: int) -> NDArray:
+    """Unpack single color marking array packed by `pack_marking`."""
+    mask = np.unpackbits(bits, count=int(np.prod(shape))).reshape(shape)
+    return mask * np.uint8(color)
+
+
+def main():
+    level = getattr(logging, CONFIG.log_level.upper())
+    format = "%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s"
+    logging.basicConfig(level=level, format=format)
+    logging.info(f"Initialize ml-models (backend: {CONFIG.ml_backend}).")
+    server = InferenceServer(
+        CONFIG.inference_server_address,
+        init_sam_predictor(),
+        init_yolo_obj(CONFIG.yolo_osm_obj),
+        init_yolo_obj(CONFIG.yolo_esri_obj),
+        init_yolo_cls(CONFIG.yolo_cls),
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,70 @@
+import copy
 import logging
+import re
 from pathlib import Path
 
+import numpy as np
 import requests
 import torch
+from PIL import Image
+from sam2.build_sam import build_sam2
+from sam2.modeling.sam2_base import SAM2Base
+from sam2.sam2_image_predictor import SAM2ImagePredictor
 from torch._prims_common import DeviceLikeType
+from ultralytics import YOLO
+from ultralytics_MB import YOLO as YOLO_MB
 
 from sketch_map_tool.config import CONFIG
 
+SAM2_CONFIG = "sam2_hiera_b+.yaml"
+SAM2_ID = "sam2_hiera_base_plus"
 
-def init_model(id: str) -> Path:
-    """Initialize model. Raise error if not found."""
+
+def init_model(
+    id: str,
+    backend: str | None = None,
+    precision: str | None = None,
+) -> Path:
+    """Initialize model. Raise error if not found.
+
+    Depending on the inference backend the model is expected to be stored as
+    PyTorch weights (`{id}.pt`), ONNX model (`{id}.onnx`) or OpenVINO IR model
+    (`{id}_openvino_model/`) inside the weights directory.
+
+    Quantized models (int8) are only supported by the ONNX backend (`{id}_int8.onnx`).
+    """
+    backend = backend or CONFIG.ml_backend
+    precision = precision or CONFIG.ml_precision
+    validate_precision(backend, precision)
     raw = Path(CONFIG.weights_dir) / id
-    path = raw.with_suffix(".pt")
-    if not path.is_file():
+    match backend:
+        case "torch":
+            path = raw.with_suffix(".pt")
+            found = path.is_file()
+        case "onnx":
+            if precision == "int8":
+                path = raw.with_name(raw.name + "_int8.onnx")
+            else:
+                path = raw.with_suffix(".onnx")
+            found = path.is_file()
+        case "openvino":
+            path = raw.with_name(raw.name + "_openvino_model")
+            found = path.is_dir()
+        case _:
+            raise ValueError("Unexpected ml backend: " + backend)
+    if not found:
         raise FileNotFoundError("Model not found at " + str(path))
     return path
 
 
-def init_sam2(id: str = "sam2_hiera_base_plus") -> Path:
+def validate_precision(backend: str, precision: str):
+    if precision not in ("fp32", "int8"):
+        raise ValueError("Unexpected ml precision: " + precision)
+    if precision == "int8" and backend != "onnx":
+        raise ValueError("Quantized (int8) models are only supported by ONNX backend.")
+
+
+def init_sam2(id: str = SAM2_ID) -> Path:
     raw = Path(CONFIG.weights_dir) / id
     path = raw.with_suffix(".pt")
     base_url = "https://dl.fbaipublicfiles.com/segment_anything_2/072824/"
@@ -30,6 +77,101 @@ def init_sam2(id: str = "sam2_hiera_base_plus") -> Path:
     return path
 
 
+def init_sam2_encoder(id: str = SAM2_ID) -> Path:
+    """Initialize SAM-2 image encoder exported to ONNX. Raise error if not found."""
+    validate_precision(CONFIG.ml_backend, CONFIG.ml_precision)
+    if CONFIG.ml_precision == "int8":
+        path = Path(CONFIG.weights_dir) / (id + "_encoder_int8.onnx")
+    else:
+        path = Path(CONFIG.weights_dir) / (id + "_encoder.onnx")
+    if not path.is_file():
+        raise FileNotFoundError("Model not found at " + str(path))
+    return path
+
+
+def init_yolo_obj(id: str) -> YOLO_MB:
+    """Initialize YOLO object detection model (multibands version)."""
+    return YOLO_MB(init_model(id), task="detect")
+
+
+def init_yolo_cls(id: str) -> YOLO:
+    """Initialize YOLO classification model."""
+    return YOLO(init_model(id), task="classify")
+
+
+def init_sam_predictor() -> SAM2ImagePredictor:
+    """Initialize SAM-2 predictor for the configured inference backend."""
+    device = select_computation_device()
+    if CONFIG.ml_backend == "torch":
+        sam2_model = build_sam2(
+            config_file=SAM2_CONFIG,
+            ckpt_path=init_sam2(),
+            device=device,
+        )
+        return SAM2ImagePredictor(sam2_model)
+    return ONNXSAM2ImagePredictor(
+        build_sam2_without_image_encoder(device),
+        init_sam2_encoder(),
+        get_onnx_providers(),
+    )
+
+
+def build_sam2_without_image_encoder(device: DeviceLikeType) -> SAM2Base:
+    """Build SAM-2 model without the weights of the image encoder.
+
+    Used if the image encoder runs on ONNX Runtime. The checkpoint is memory-mapped
+    and only the weights of prompt encoder, mask decoder and memory modules are
+    loaded. The fp32 weights of the image encoder (most of the model) are not.
+    """
+    sam2_model = build_sam2(config_file=SAM2_CONFIG, ckpt_path=None, device="cpu")
+    sam2_model.image_encoder = torch.nn.Identity()
+    state_dict = torch.load(
+        init_sam2(),
+        map_location="cpu",
+        weights_only=True,
+        mmap=True,
+    )["model"]
+    state_dict = {
+        k: v for k, v in state_dict.items() if not k.startswith("image_encoder.")
+    }
+    missing, unexpected = sam2_model.load_state_dict(state_dict, strict=False)
+    if missing or unexpected:
+        raise RuntimeError(
+            "Unexpected SAM-2 checkpoint. "
+            + f"Missing keys: {missing}. Unexpected keys: {unexpected}."
+        )
+    return sam2_model.to(device)
+
+
+def clone_sam_predictor(sam_predictor: SAM2ImagePredictor) -> SAM2ImagePredictor:
+    """Create a new predictor sharing the model with given predictor.
+
+    Predictors are stateful (embeddings of the image set last) but the model (and
+    the ONNX Runtime session) are not. Clones can be used by concurrent threads.
+    """
+    clone = copy.copy(sam_predictor)
+    clone.reset_predictor()
+    return clone
+
+
+def get_onnx_providers() -> list[str]:
+    """Get ONNX Runtime execution providers for the configured inference backend."""
+    if CONFIG.ml_backend == "openvino":
+        return ["OpenVINOExecutionProvider", "CPUExecutionProvider"]
+    return ["CPUExecutionProvider"]
+
+
+def fuse_yolo_models(*yolos: YOLO | YOLO_MB):
+    """Fuse layers of YOLO models before forking.
+
+    Weights of models loaded before fork are shared with the forked processes
+    (copy-on-write) as long as they are not written. Ultralytics fuses layers on
+    first prediction, which would result in private copies in each forked process.
+    """
+    for yolo in yolos:
+        yolo.model.fuse(verbose=False)
+
+
 def select_computation_device() -> DeviceLikeType:
     """Select computation device (cuda, mps, cpu) for SAM-2"""
     if torch.cuda.is_available():
@@ -48,3 +190,163 @@ def select_computation_device() -> DeviceLikeType:
             torch.backends.cuda.matmul.allow_tf32 = True
             torch.backends.cudnn.allow_tf32 = True
     return device
+
+
+class SAM2ImageEncoder(torch.nn.Module):
+    """Image encoder of SAM-2 as standalone module (e.g. for export to ONNX).
+
+    Computes the same image features as `SAM2ImagePredictor.set_image`.
+    """
+
+    # Spatial dimension for backbone feature maps
+    bb_feat_sizes = [(256, 256), (128, 128), (64, 64)]
+
+    def __init__(self, model: SAM2Base):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image: torch.Tensor) -> tuple[torch.Tensor, ...]:
+        backbone_out = self.model.forward_image(image)
+        _, vision_feats, _, _ = self.model._prepare_backbone_features(backbone_out)
+        if self.model.directly_add_no_mem_embed:
+            vision_feats[-1] = vision_feats[-1] + self.model.no_mem_embed
+        feats = [
+            feat.permute(1, 2, 0).view(1, -1, *feat_size)
+            for feat, feat_size in zip(vision_feats[::-1], self.bb_feat_sizes[::-1])
+        ][::-1]
+        image_embed, high_res_feats = feats[-1], feats[:-1]
+        return image_embed, *high_res_feats
+
+
+class ONNXSAM2ImagePredictor(SAM2ImagePredictor):
+    """SAM-2 predictor computing image embeddings with ONNX Runtime.
+
+    Only the image encoder, which is the expensive part of SAM-2, runs on ONNX
+    Runtime. Prompt encoding and mask decoding are lightweight and stay in PyTorch.
+    """
+
+    def __init__(
+        self,
+        sam_model: SAM2Base,
+        encoder_path: Path,
+        providers: list[str],
+        **kwargs,
+    ):
+        try:
+            import onnxruntime
+        except ImportError as error:
+            raise ImportError(
+                f"ONNX Runtime is required for the ml backend '{CONFIG.ml_backend}'. "
+                + f"Please install the extra `{CONFIG.ml_backend}` "
+                + f"(`uv sync --extra {CONFIG.ml_backend}`)."
+            ) from error
+        super().__init__(sam_model, **kwargs)
+        # Image encoder weights are not needed (if loaded at all). Free memory.
+        self.model.image_encoder = torch.nn.Identity()
+        self.session = onnxruntime.InferenceSession(
+            str(encoder_path),
+            providers=providers,
+        )
+
+    @torch.no_grad()
+    def set_image(self, image: np.ndarray | Image.Image) -> None:
+        self.reset_predictor()
+        if isinstance(image, np.ndarray):
+            self._orig_hw = [image.shape[:2]]
+        else:
+            width, height = image.size
+            self._orig_hw = [(height, width)]
+        input_image = self._transforms(image)[None, ...].numpy()
+        image_embed, *high_res_feats = self.session.run(None, {"image": input_image})
+        self._features = {
+            "image_embed": torch.from_numpy(image_embed).to(self.device),
+            "high_res_feats": [
+                torch.from_numpy(f).to(self.device) for f in high_res_feats
+            ],
+        }
+        self._is_image_set = True
+
+
+def export_yolo(id: str, format: str) -> Path:
+    """Export YOLO model to ONNX or OpenVINO IR next to the PyTorch weights."""
+    path = init_model(id, backend="torch")
+    model = YOLO_MB(path) if id != CONFIG.yolo_cls else YOLO(path)
+    return Path(model.export(format=format, dynamic=True))
+
+
+def export_sam2_encoder(id: str = SAM2_ID) -> Path:
+    """Export image encoder of SAM-2 to ONNX."""
+    sam2_model = build_sam2(
+        config_file=SAM2_CONFIG,
+        ckpt_path=init_sam2(id),
+        device="cpu",
+    )
+    encoder = SAM2ImageEncoder(sam2_model).eval()
+    path = Path(CONFIG.weights_dir) / (id + "_encoder.onnx")
+    image = torch.zeros(1, 3, sam2_model.image_size, sam2_model.image_size)
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder,
+            (image,),
+            str(path),
+            input_names=["image"],
+            output_names=["image_embed", "high_res_feats_0", "high_res_feats_1"],
+            opset_version=17,
+        )
+    return path
+
+
+def quantize_yolo(id: str) -> Path:
+    """Quantize the head of an YOLO model exported to ONNX to int8 weights."""
+    path = init_model(id, backend="onnx", precision="fp32")
+    return quantize_onnx(path, nodes_to_quantize=get_yolo_head_nodes(path))
+
+
+def quantize_sam2_encoder(id: str = SAM2_ID) -> Path:
+    """Quantize image encoder of SAM-2 exported to ONNX to int8 weights.
+
+    Only the weights of the matrix multiplications (transformer blocks of the Hiera
+    image encoder) are quantized.
+    """
+    path = Path(CONFIG.weights_dir) / (id + "_encoder.onnx")
+    if not path.is_file():
+        raise FileNotFoundError("Model not found at " + str(path))
+    return quantize_onnx(path, op_types_to_quantize=["MatMul", "Gemm"])
+
+
+def quantize_onnx(path: Path, **kwargs) -> Path:
+    """Dynamic quantization of an ONNX model to int8 weights.
+
+    Quantized model is written next to given model with the suffix `_int8`.
+    Model metadata (e.g. names of classes needed by ultralytics) is preserved.
+    """
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    path_int8 = path.with_name(path.stem + "_int8.onnx")
+    quantize_dynamic(path, path_int8, weight_type=QuantType.QInt8, **kwargs)
+
+    model = onnx.load(path)
+    model_int8 = onnx.load(path_int8)
+    del model_int8.metadata_props[:]
+    model_int8.metadata_props.extend(model.metadata_props)
+    onnx.save(model_int8, path_int8)
+    return path_int8
+
+
+def get_yolo_head_nodes(path: Path) -> list[str]:
+    """Get names of the nodes of the head (last module) of an YOLO ONNX model.
+
+    Node names of models exported by ultralytics are prefixed by module index.
+    (E.g. `/model.22/cv2.0/cv2.0.0/conv/Conv`)
+    """
+    import onnx
+
+    graph = onnx.load(path).graph
+    indexes = {}
+    for node in graph.node:
+        match = re.match(r"^/model\.(\d+)/", node.name)
+        if match:
+            indexes[node.name] = int(match.group(1))
+    head = max(indexes.values())
+    return [name for name, index in indexes.items() if index == head]
@@ -1,22 +1,83 @@
-from copy import deepcopy
 from io import BytesIO
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
+from typing import Iterator
+from uuid import uuid4
 
 import geojson
+import numpy as np
 from geojson import FeatureCollection
+from numpy.typing import NDArray
 from osgeo import gdal, ogr
-from pyproj import Transformer
+
+from sketch_map_tool.helpers import get_transformer
+from sketch_map_tool.models import Bbox
+from sketch_map_tool.upload_processing.georeference import (
+    crop_to_content,
+    get_bounding_rect,
+    get_geotransform,
+    get_projection,
+    read_vsimem,
+)
 
 
 def transform(feature: FeatureCollection) -> FeatureCollection:
-    """Reproject GeoJSON from WebMercator to EPSG:4326"""
-    transformer = Transformer.from_crs("EPSG:3857", "EPSG:4326", always_xy=True)
-    raw = geojson.utils.map_tuples(  # type: ignore
-        lambda coordinates: transformer.transform(coordinates[0], coordinates[1]),
-        deepcopy(feature),
-    )
-    return geojson.loads(geojson.dumps(raw))
+    """Reproject GeoJSON from WebMercator to EPSG:4326 (in-place).
+
+    Coordinates of all geometries are transformed at once (vectorized).
+    """
+    transformer = get_transformer("EPSG:3857", "EPSG:4326", always_xy=True)
+    positions = []  # references to all positions
+    for geometry in _geometries(feature):
+        if geometry["type"] == "Point":
+            positions.append(geometry["coordinates"])
+        else:
+            for line in _lines(geometry["coordinates"], DEPTHS[geometry["type"]]):
+                positions.extend(line)
+    if len(positions) == 0:
+        return feature
+    coordinates = np.array(positions, dtype=np.float64)
+    x, y = transformer.transform(coordinates[:, 0], coordinates[:, 1])
+    coordinates[:, 0] = x
+    coordinates[:, 1] = y
+    for position, transformed in zip(positions, coordinates.tolist()):
+        position[:] = transformed
+    return feature
+
+
+# nesting depth of lists of positions of geometry types
+DEPTHS = {
+    "MultiPoint": 1,
+    "LineString": 1,
+    "MultiLineString": 2,
+    "Polygon": 2,
+    "MultiPolygon": 3,
+}
+
+
+def _geometries(obj: dict) -> Iterator[dict]:
+    """Yield all geometries of a GeoJSON object (e.g. a FeatureCollection)."""
+    if obj is None:
+        return
+    if obj["type"] == "FeatureCollection":
+        for feature in obj["features"]:
+            yield from _geometries(feature)
+    elif obj["type"] == "Feature":
+        yield from _geometries(obj["geometry"])
+    elif obj["type"] == "GeometryCollection":
+        for geometry in obj["geometries"]:
+            yield from _geometries(geometry)
+    else:
+        yield obj
+
+
+def _lines(coordinates: list, depth: int) -> Iterator[list]:
+    """Yield lists of positions (e.g. rings of polygons) of nested coordinates."""
+    if depth == 1:
+        yield coordinates
+    else:
+        for c in coordinates:
+            yield from _lines(c, depth - 1)
 
 
 def polygonize(geotiff: BytesIO, layer_name: str) -> FeatureCollection:
@@ -52,3 +113,84 @@ def polygonize(geotiff: BytesIO, layer_name: str) -> FeatureCollection:
         with open(outfile_name, "rb") as f:
             fc = geojson.load(f)
             return transform(fc)
+
+
+def polygonize_markings(
+    markings: list[NDArray],
+    bbox: Bbox,
+    layer_name: str,
+) -> list[FeatureCollection]:
+    """Produces a polygon feature layer (GeoJSON) for each marking.
+
+    Instead of georeferencing and polygonizing each marking on its own, all markings
+    are written to one label raster (value is the marking index + 1), which is
+    polygonized once. Features are split back per marking afterwards and get the
+    color of the marking as property. The result is the same as of
+    `polygonize(georeference(marking))` without the polygons of the background.
+
+    Overlapping markings can not be written to the same label raster. They are
+    distributed to as few label rasters as needed.
+    """
+    colors = [int(m.max(initial=0)) for m in markings]
+    fcs = [FeatureCollection(features=[]) for _ in markings]
+    for labels in create_label_rasters(markings):
+        for feature in polygonize_labels(labels, bbox, layer_name)["features"]:
+            i = feature["properties"].pop("label") - 1
+            feature["properties"]["color"] = str(colors[i])
+            fcs[i]["features"].append(feature)
+    return fcs
+
+
+def create_label_rasters(markings: list[NDArray]) -> list[NDArray]:
+    """Write markings to label rasters with the marking index + 1 as value.
+
+    Markings are greedily assigned to the first label raster they do not overlap
+    with in any pixel. Empty markings are skipped.
+    """
+    label_rasters: list[NDArray] = []
+    for i, marking in enumerate(markings):
+        rect = get_bounding_rect(marking)
+        if rect is None:
+            continue
+        x0, y0, x1, y1 = rect
+        mask = marking[y0:y1, x0:x1] > 0
+        for labels in label_rasters:
+            if not labels[y0:y1, x0:x1][mask].any():
+                break
+        else:
+            labels = np.zeros(marking.shape, dtype=np.uint16)
+            label_rasters.append(labels)
+        labels[y0:y1, x0:x1][mask] = i + 1
+    return label_rasters
+
+
+def polygonize_labels(labels: NDArray, bbox: Bbox, layer_name: str) -> dict:
+    """Polygonize a label raster in memory. Background (0) is not polygonized.
+
+    Only the bounding rectangle of all labels is polygonized.
+    """
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+
+    labels, bbox = crop_to_content(labels, bbox)
+    height, width = labels.shape
+    src_ds = gdal.GetDriverByName("MEM").Create("", width, height, 1, gdal.GDT_UInt16)
+    src_ds.SetGeoTransform(get_geotransform(bbox, width, height))
+    src_ds.SetProjection(get_projection())
+    src_band = src_ds.GetRasterBand(1)
+    src_band.WriteArray(labels)
+
+    path = "/vsimem/polygonize-{}.geojson".format(uuid4())
+    dst_ds = ogr.GetDriverByName("GeoJSON").CreateDataSource(path)
+    try:
+        dst_layer = dst_ds.CreateLayer(layer_name, srs=src_ds.GetSpatialRef())
+        dst_layer.CreateField(ogr.FieldDefn("label", ogr.OFTInteger))
+        # (srcBand, maskBand, outLayer, iPixValField)
+        gdal.Polygonize(src_band, src_band, dst_layer, 0)
+        src_ds = None  # close dataset
+        dst_ds = None  # close dataset
+        return transform(geojson.loads(read_vsimem(path)))
+    finally:
+        src_ds = None
+        dst_ds = None
+        gdal.Unlink(path)
@@ -1,15 +1,18 @@
 from dataclasses import astuple
 
 import geojson
-import pyproj
+import numpy as np
+import shapely
 import shapely.geometry
 from geojson import FeatureCollection
+from numpy.typing import NDArray
 from shapely import MultiPolygon, Polygon
-from shapely.ops import transform, unary_union
+from shapely.ops import transform
 from shapelysmooth import chaikin_smooth
 
 from sketch_map_tool.config import CONFIG
 from sketch_map_tool.definitions import COLORS
+from sketch_map_tool.helpers import get_transformer
 from sketch_map_tool.models import Bbox
 
 
@@ -18,12 +21,49 @@ def post_process(
     name: str,
     bbox: Bbox,
 ) -> FeatureCollection:
+    """Post process GeoJSON of a single marking.
+
+    GeoJSON is converted to an array of shapely geometries once after cleaning and
+    enriching. Simplifying, smoothing and classifying is done on this array.
+    """
     fc = clean(fc)
     fc = enrich(fc, properties={"name": name})
-    fc = simplify(fc)
-    fc = smooth(fc)
-    fc = classify_points(fc, bbox=bbox)
-    return fc
+    properties = fc["features"][0]["properties"]  # properties are the same
+    geometries, _ = to_geometries(fc)
+    geometries = simplify_geometries(geometries)
+    geometries = smooth_geometries(geometries)
+    geometries = classify_point_geometries(geometries, bbox)
+    return to_feature_collection(geometries, [properties] * len(geometries))
+
+
+def to_geometries(fc: FeatureCollection) -> tuple[NDArray, list[dict]]:
+    """Convert GeoJSON to an array of shapely geometries and a list of properties."""
+    geometries = np.array(
+        [shapely.geometry.shape(feature["geometry"]) for feature in fc["features"]],
+        dtype=object,
+    )
+    properties = [feature["properties"] for feature in fc["features"]]
+    return geometries, properties
+
+
+def to_feature_collection(
+    geometries: NDArray,
+    properties: list[dict],
+) -> FeatureCollection:
+    """Convert an array of shapely geometries to GeoJSON.
+
+    Missing geometries (None) are skipped.
+    """
+    return FeatureCollection(
+        [
+            geojson.Feature(
+                geometry=shapely.geometry.mapping(geometry),
+                properties=p,
+            )
+            for geometry, p in zip(geometries, properties)
+            if geometry is not None
+        ]
+    )
 
 
 def clean(fc: FeatureCollection) -> FeatureCollection:
@@ -56,59 +96,40 @@ def enrich(fc: FeatureCollection, properties):
 def simplify(fc: FeatureCollection) -> FeatureCollection:
     """Simplifies the geometries in a GeoJSON FeatureCollection.
 
-    Buffers each geometry based on a percentage of the maximum width, dissolves the
-    geometries based on the 'color' attribute, removes inner rings, and then re-applies
-    a negative buffer to restore the original size.
-
-    The function assumes that the 'color' field exists in the properties of the
-    features.
+    See `simplify_geometries`. The result is a single feature with the properties
+    of the first feature.
     """
-    features = fc["features"]
-    properties = features[0]["properties"]  # properties for each features are the same
-    geometries = [shapely.geometry.shape(feature["geometry"]) for feature in features]
+    geometries, properties = to_geometries(fc)
+    geometries = simplify_geometries(geometries)
+    return to_feature_collection(geometries, properties[:1])
+
+
+def simplify_geometries(geometries: NDArray) -> NDArray:
+    """Simplifies and dissolves geometries to a single geometry.
 
+    Buffers each geometry based on a percentage of the maximum width, dissolves the
+    geometries, removes inner rings, and then re-applies a negative buffer to
+    restore the original size.
+    """
     # Buffer operation
     buffer_distance_percentage = 0.1
 
     # NOTE: does this work for bbox including antimeridian?
     #   (Currently SMT does not allow bbox including antimeridian as input)
-    max_diag = max(
-        (
-            # bounds: (minx, miny, maxx, maxy)
-            (geometry.bounds[2] - geometry.bounds[0]) ** 2
-            + (geometry.bounds[3] - geometry.bounds[1]) ** 2
-        )
-        ** 0.5
-        for geometry in geometries
+    # bounds: (minx, miny, maxx, maxy)
+    bounds = shapely.bounds(geometries)
+    diags = np.sqrt(
+        (bounds[:, 2] - bounds[:, 0]) ** 2 + (bounds[:, 3] - bounds[:, 1]) ** 2
     )
+    max_diag = float(np.max(diags))
     buffer_distance = buffer_distance_percentage * max_diag
-    buffered_geometries = [geometry.buffer(buffer_distance) for geometry in geometries]
-    # Dissolve by color field (assuming there's a "color" field)
-    dissolved_geometries = unary_union(buffered_geometries)
-    if isinstance(dissolved_geometries, list):
-        dissolved_geometries = [
-            remove_inner_rings(geometry) for geometry in dissolved_geometries
-        ]
-    else:
-        dissolved_geometries = [remove_inner_rings(dissolved_geometries)]
-
-    simplified_geometries = [
-        geometry.buffer(-buffer_distance).simplify(0.0025 * max_diag)
-        for geometry in dissolved_geometries
-    ]
-
-    # Create a single GeoJSON feature
-    features = [
-        geojson.Feature(
-            geometry=shapely.geometry.mapping(geometry),
-            properties=properties,
-        )
-        for geometry in simplified_geometries
-    ]
-
-    # Create a GeoJSON feature collection with the single feature
-    fc = geojson.FeatureCollection(features)
-    return fc
+    buffered_geometries = shapely.buffer(geometries, buffer_distance)
+    dissolved_geometry = remove_inner_rings(shapely.union_all(buffered_geometries))
+    simplified_geometry = shapely.simplify(
+        shapely.buffer(dissolved_geometry, -buffer_distance),
+        0.0025 * max_diag,
+    )
+    return np.array([simplified_geometry], dtype=object)
 
 
 def remove_inner_rings(geometry: Polygon | MultiPolygon) -> Polygon | MultiPolygon:
@@ -126,66 +147,47 @@ def remove_inner_rings(geometry: Polygon | MultiPolygon) -> Polygon | MultiPolyg
 def smooth(fc: FeatureCollection) -> FeatureCollection:
     """Smoothens the polygon geometries in a GeoJSON FeatureCollection.
 
-    This function applies a Chaikin smoothing algorithm to each polygon geometry in the
-    given FeatureCollection. Non-polygon geometries are skipped. The function updates
-    the geometries while retaining the properties of each feature.
+    See `smooth_geometries`. Features without polygon geometries are skipped.
     """
-    features = fc["features"]
-    updated_features = []
-
-    for feature in features:
-        geometry = feature["geometry"]
-        properties = feature["properties"]
+    geometries, properties = to_geometries(fc)
+    return to_feature_collection(smooth_geometries(geometries), properties)
 
-        if geometry["type"] == "Polygon":
-            geometry = Polygon(geometry["coordinates"][0])  # Exterior ring
-        else:
-            continue  # Skip non-polygon geometries
 
-        corrected_geometry = chaikin_smooth(geometry)
+def smooth_geometries(geometries: NDArray) -> NDArray:
+    """Smoothens polygon geometries.
 
-        updated_features.append(
-            geojson.Feature(
-                geometry=shapely.geometry.mapping(corrected_geometry),
-                properties=properties,
-            )
-        )
-
-    fc = geojson.FeatureCollection(updated_features)
-    return fc
+    This function applies a Chaikin smoothing algorithm to the exterior ring of each
+    polygon geometry. Non-polygon and empty geometries are replaced by None.
+    """
+    smoothed_geometries = np.full(len(geometries), None, dtype=object)
+    is_polygon = shapely.get_type_id(geometries) == shapely.GeometryType.POLYGON
+    is_polygon &= ~shapely.is_empty(geometries)
+    exteriors = shapely.polygons(shapely.get_exterior_ring(geometries[is_polygon]))
+    smoothed_geometries[is_polygon] = [chaikin_smooth(e) for e in exteriors]
+    return smoothed_geometries
 
 
 def classify_points(fc: FeatureCollection, bbox: Bbox) -> FeatureCollection:
     """Classify each feature as point or polygon based area."""
-    point_area_threshold = CONFIG.point_area_threshold
-    fc_ = FeatureCollection(features=[])
-
-    for feature in fc["features"]:
-        geom_feature = shapely.geometry.shape(feature["geometry"])
-        geom_map_frame = transform_3857_to_4326(shapely.geometry.box(*astuple(bbox)))
+    geometries, properties = to_geometries(fc)
+    geometries = classify_point_geometries(geometries, bbox)
+    return to_feature_collection(geometries, properties)
 
-        area_map_frame = geom_map_frame.area
-        area_feature = geom_feature.area
 
-        ratio = area_feature / area_map_frame
-
-        if ratio < point_area_threshold:
-            geom = geom_feature.centroid
-        else:
-            geom = geom_feature
-
-        fc_.features.append(
-            geojson.Feature(
-                geometry=shapely.geometry.mapping(geom),
-                properties=feature["properties"],
-            )
-        )
+def classify_point_geometries(geometries: NDArray, bbox: Bbox) -> NDArray:
+    """Replace geometries by their centroid if their area relative to the area of the
+    map frame is below a threshold (`point_area_threshold`)."""
+    geom_map_frame = transform_3857_to_4326(shapely.geometry.box(*astuple(bbox)))
+    area_map_frame = geom_map_frame.area
 
-    return fc_
+    geometries = geometries.copy()
+    with np.errstate(invalid="ignore"):  # area of missing geometries is NaN
+        ratio = shapely.area(geometries) / area_map_frame
+    is_point = ratio < CONFIG.point_area_threshold
+    geometries[is_point] = shapely.centroid(geometries[is_point])
+    return geometries
 
 
 def transform_3857_to_4326(geom: Polygon) -> Polygon:
-    wgs84 = pyproj.CRS("EPSG:4326")
-    pseudo = pyproj.CRS("EPSG:3857")
-    project = pyproj.Transformer.from_crs(pseudo, wgs84).transform
+    project = get_transformer("EPSG:3857", "EPSG:4326").transform
     return transform(project, geom)
@@ -0,0 +1,51 @@
+"""Benchmark clipping based on BRISK features against megapixels of the photo.
+
+Compares matching in full resolution with coarse-to-fine matching
+(`clip_coarse_max_side`, set by `--coarse-max-side`). The fixture photo is scaled to
+each size. Clipping based on ArUco markers is bypassed.
+"""
+
+import argparse
+import time
+
+import cv2
+
+from sketch_map_tool.config import CONFIG
+from sketch_map_tool.upload_processing.clip import (
+    compute_template_features,
+    find_homography_brisk,
+)
+from tests import FIXTURE_DIR
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--megapixels",
+        type=float,
+        nargs="+",
+        default=[2, 4, 8, 12, 16, 24],
+    )
+    parser.add_argument("--coarse-max-side", type=int, default=2000)
+    args = parser.parse_args()
+
+    photo = cv2.imread(str(FIXTURE_DIR / "clip" / "1-photo-of-sketch-map.jpg"))
+    template = cv2.imread(str(FIXTURE_DIR / "clip" / "1-map-frame.png"))
+    height, width, _ = template.shape
+    features = compute_template_features(template)
+
+    print("megapixels  full  coarse-to-fine")
+    for megapixels in args.megapixels:
+        factor = (megapixels * 1e6 / (photo.shape[0] * photo.shape[1])) ** 0.5
+        photo_scaled = cv2.resize(photo, None, fx=factor, fy=factor)
+        durations = []
+        for max_side in (0, args.coarse_max_side):
+            CONFIG.clip_coarse_max_side = max_side
+            start = time.perf_counter()
+            find_homography_brisk(photo_scaled, features, (width, height))
+            durations.append(time.perf_counter() - start)
+        print(f"{megapixels:>10} {durations[0]:>5.2f}s {durations[1]:>5.2f}s")
+
+
+if __name__ == "__main__":
+    main()
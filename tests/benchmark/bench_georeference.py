@@ -0,0 +1,83 @@
+"""Benchmark georeferencing of markings in memory (`/vsimem/`) vs. temporary files.
+
+`georeference_tempfile` is the former implementation writing a GeoTIFF to a
+temporary directory and reading it back. Both implementations return the same
+bytes.
+"""
+
+import argparse
+import time
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import cv2
+import numpy as np
+from numpy.typing import NDArray
+from osgeo import gdal, osr
+
+from sketch_map_tool.models import Bbox
+from sketch_map_tool.upload_processing.georeference import georeference
+from tests import FIXTURE_DIR
+
+
+def georeference_tempfile(img: NDArray, bbox: Bbox) -> BytesIO:
+    gdal.UseExceptions()
+    width = img.shape[1]
+    height = img.shape[0]
+    pixel_width = abs(bbox.lon_max - bbox.lon_min) / width
+    pixel_height = abs(bbox.lat_max - bbox.lat_min) / height
+    with TemporaryDirectory() as tmpdirname:
+        outfile_name = Path(tmpdirname) / "out.geotiff"
+        dataset = gdal.GetDriverByName("GTiff").Create(
+            str(outfile_name),
+            width,
+            height,
+            1,
+            gdal.GDT_Byte,
+        )
+        dataset.GetRasterBand(1).WriteArray(img)
+        dataset.SetGeoTransform(
+            [bbox.lon_min, pixel_width, 0, bbox.lat_max, 0, -pixel_height]
+        )
+        spatial_reference_system = osr.SpatialReference()
+        spatial_reference_system.ImportFromEPSG(3857)
+        dataset.SetProjection(spatial_reference_system.ExportToWkt())
+        dataset = None
+        with open(outfile_name, "rb") as f:
+            return BytesIO(f.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--markings", type=int, default=50)
+    args = parser.parse_args()
+
+    img = cv2.imread(str(FIXTURE_DIR / "map-frame.png"))
+    # single color marking (as returned by `detect_markings`)
+    marking = np.zeros(img.shape[:2], dtype=np.uint8)
+    marking[100:300, 200:400] = 3
+    bbox = Bbox(
+        lon_min=964472.1973848869,
+        lat_min=6343459.035638228,
+        lon_max=967434.6098457306,
+        lat_max=6345977.635778541,
+    )
+    assert (
+        georeference(marking, bbox, bgr=False).getvalue()
+        == georeference_tempfile(marking, bbox).getvalue()
+    )
+
+    durations = []
+    for func in (georeference_tempfile, lambda m, b: georeference(m, b, bgr=False)):
+        start = time.perf_counter()
+        for _ in range(args.markings):
+            func(marking, bbox)
+        durations.append((time.perf_counter() - start) / args.markings * 1000)
+    print(f"marking size: {marking.shape[1]}x{marking.shape[0]}")
+    print(f"temporary file: {durations[0]:.2f} ms per marking")
+    print(f"in-memory:      {durations[1]:.2f} ms per marking")
+
+
+if __name__ == "__main__":
+    main()
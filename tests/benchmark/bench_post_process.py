@@ -0,0 +1,92 @@
+"""Benchmark per-feature overhead of classifying points in the post processing.
+
+`classify_points_uncached` is the former implementation creating a transformer and
+reprojecting the map frame for every feature. Both implementations return the same
+result.
+"""
+
+import argparse
+import time
+from dataclasses import astuple
+
+import geojson
+import pyproj
+import shapely.geometry
+from geojson import FeatureCollection
+from shapely.ops import transform
+
+from sketch_map_tool.config import CONFIG
+from sketch_map_tool.models import Bbox
+from sketch_map_tool.upload_processing.post_process import classify_points
+
+
+def classify_points_uncached(fc: FeatureCollection, bbox: Bbox) -> FeatureCollection:
+    fc_ = FeatureCollection(features=[])
+    for feature in fc["features"]:
+        geom_feature = shapely.geometry.shape(feature["geometry"])
+        wgs84 = pyproj.CRS("EPSG:4326")
+        pseudo = pyproj.CRS("EPSG:3857")
+        project = pyproj.Transformer.from_crs(pseudo, wgs84).transform
+        geom_map_frame = transform(project, shapely.geometry.box(*astuple(bbox)))
+        ratio = geom_feature.area / geom_map_frame.area
+        if ratio < CONFIG.point_area_threshold:
+            geom = geom_feature.centroid
+        else:
+            geom = geom_feature
+        fc_.features.append(
+            geojson.Feature(
+                geometry=shapely.geometry.mapping(geom),
+                properties=feature["properties"],
+            )
+        )
+    return fc_
+
+
+def create_feature_collection(bbox: Bbox, features: int) -> FeatureCollection:
+    """Create squares of different size (points and polygons) in EPSG:4326."""
+    project = pyproj.Transformer.from_crs("EPSG:3857", "EPSG:4326").transform
+    width = bbox.lon_max - bbox.lon_min
+    fc = FeatureCollection(features=[])
+    for i in range(features):
+        size = width * (0.001 + 0.05 * (i % 10) / 10)
+        x = bbox.lon_min + width * (i % 20) / 20
+        y = bbox.lat_min + (bbox.lat_max - bbox.lat_min) * (i // 20 % 20) / 20
+        geom = transform(project, shapely.geometry.box(x, y, x + size, y + size))
+        fc.features.append(
+            geojson.Feature(
+                geometry=shapely.geometry.mapping(geom),
+                properties={"color": "#FF0000", "name": "bench"},
+            )
+        )
+    return fc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--features", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    bbox = Bbox(
+        lon_min=964472.1973848869,
+        lat_min=6343459.035638228,
+        lon_max=967434.6098457306,
+        lat_max=6345977.635778541,
+    )
+    fc = create_feature_collection(bbox, args.features)
+    assert classify_points(fc, bbox) == classify_points_uncached(fc, bbox)
+
+    durations = []
+    for func in (classify_points_uncached, classify_points):
+        start = time.perf_counter()
+        for _ in range(args.runs):
+            func(fc, bbox)
+        duration = (time.perf_counter() - start) / args.runs / args.features
+        durations.append(duration * 1e6)
+    print(f"features: {args.features}")
+    print(f"uncached: {durations[0]:.1f} µs per feature")
+    print(f"cached:   {durations[1]:.1f} µs per feature")
+
+
+if __name__ == "__main__":
+    main()
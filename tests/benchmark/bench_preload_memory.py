@@ -0,0 +1,75 @@
+"""Benchmark memory usage of Celery worker processes with and without preloading.
+
+Simulates a Celery worker (prefork pool): Worker processes are forked from a main
+process and run one marking detection each.
+- without preloading: each worker process loads its own ml-models
+- with preloading: ml-models are loaded once by the main process before forking
+  (`ml_models_preload`) and are shared copy-on-write
+
+Memory usage (see `get_memory_usage`) of each worker process is measured after the
+detection while all worker processes are alive. The savings per worker process are
+the difference in `uss`.
+"""
+
+import argparse
+import multiprocessing
+
+import cv2
+
+from sketch_map_tool import tasks
+from sketch_map_tool.helpers import get_memory_usage
+from sketch_map_tool.upload_processing.detect_markings import detect_markings
+from sketch_map_tool.upload_processing.ml_models import fuse_yolo_models
+from tests import FIXTURE_DIR
+
+
+def work(queue, barrier):
+    if tasks.sam_predictor is None:
+        tasks.load_ml_models()
+    detect_markings(
+        cv2.imread(str(FIXTURE_DIR / "map-frame-markings.png")),
+        cv2.imread(str(FIXTURE_DIR / "map-frame.png")),
+        tasks.yolo_obj_osm,
+        tasks.yolo_cls,
+        tasks.sam_predictor,
+    )
+    barrier.wait()  # measure while all worker processes are alive
+    queue.put(get_memory_usage())
+    barrier.wait()
+
+
+def run(workers: int) -> dict[str, float]:
+    """Run worker processes. Return their mean memory usage in MB."""
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    barrier = context.Barrier(workers)
+    processes = [
+        context.Process(target=work, args=(queue, barrier)) for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    usages = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {k: sum(u[k] for u in usages) / len(usages) / 1024 for k in usages[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    own = run(args.workers)
+    tasks.load_ml_models()
+    fuse_yolo_models(tasks.yolo_obj_osm, tasks.yolo_obj_esri, tasks.yolo_cls)
+    preloaded = run(args.workers)
+
+    print(f"worker processes: {args.workers}")
+    print("mean per worker process [MB]:", *(f"{k:>6}" for k in own))
+    print("without preloading:          ", *(f"{v:6.0f}" for v in own.values()))
+    print("with preloading:             ", *(f"{v:6.0f}" for v in preloaded.values()))
+    print(f"savings per worker process (uss): {own['uss'] - preloaded['uss']:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
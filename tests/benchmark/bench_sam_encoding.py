@@ -0,0 +1,93 @@
+"""Benchmark peak memory of SAM with full and region of interest encoding.
+
+For each paper format a sketch map frame at scanning resolution is simulated by
+scaling the fixture `map-frame-markings.png` to the size of the paper. Each run is
+done in a fresh process to measure its peak memory (maximum resident set size).
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image
+
+from sketch_map_tool.config import CONFIG
+from sketch_map_tool.definitions import ALL_PAPER_FORMATS
+from sketch_map_tool.models import PaperFormat
+from sketch_map_tool.upload_processing.detect_markings import (
+    apply_sam,
+    apply_yolo_object_detection,
+)
+from sketch_map_tool.upload_processing.ml_models import (
+    init_sam_predictor,
+    init_yolo_obj,
+)
+from tests import FIXTURE_DIR
+
+
+def detect_bounding_boxes() -> NDArray:
+    """Detect bounding boxes on fixture. Coordinates are relative to image size."""
+    image = Image.open(FIXTURE_DIR / "map-frame-markings.png").convert("RGB")
+    map_frame = Image.open(FIXTURE_DIR / "map-frame.png").convert("RGB")
+    yolo = init_yolo_obj(CONFIG.yolo_osm_obj)
+    bounding_boxes, _ = apply_yolo_object_detection(image, map_frame, yolo)
+    return bounding_boxes / np.tile(image.size, 2)
+
+
+def run(
+    paper_format: PaperFormat,
+    dpi: int,
+    bounding_boxes: NDArray,
+    mode: str,
+) -> tuple[float, int, int]:
+    """Run SAM. Return duration, and maximum resident set size [MB] before and
+    after running SAM."""
+    CONFIG.sam_encoding = mode  # type: ignore
+    sam_predictor = init_sam_predictor()
+    image = Image.open(FIXTURE_DIR / "map-frame-markings.png").convert("RGB")
+    size = (
+        round(paper_format.width / 2.54 * dpi),
+        round(paper_format.height / 2.54 * dpi),
+    )
+    image = image.resize(size)
+    bounding_boxes = bounding_boxes * np.tile(size, 2)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    start = time.perf_counter()
+    apply_sam(image, bounding_boxes, sam_predictor)
+    duration = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    return duration, baseline, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dpi", type=int, default=300)
+    args = parser.parse_args()
+
+    bounding_boxes = detect_bounding_boxes()
+    print(f"dpi: {args.dpi}, bounding boxes: {len(bounding_boxes)}")
+    print("format  mode  duration  peak memory (baseline)")
+    for paper_format in ALL_PAPER_FORMATS:
+        for mode in ("full", "roi"):
+            context = multiprocessing.get_context("spawn")  # fresh memory counters
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                future = executor.submit(
+                    run,
+                    paper_format,
+                    args.dpi,
+                    bounding_boxes,
+                    mode,
+                )
+                duration, baseline, peak = future.result()
+            print(
+                f"{paper_format.title:<7} {mode:<5} {duration:>7.2f}s "
+                + f"{peak:>7} MB ({baseline} MB)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Benchmark YOLO object detection with and without batching of concurrent requests.
+
+Simulates a digitize request of 100 files processed by Celery workers:
+- one-at-a-time: each worker runs object detection on its own image
+- batched: workers send requests to the inference server, which batches requests
+  arriving within a short time window (`inference_server_batch_wait`)
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from sketch_map_tool.config import CONFIG
+from sketch_map_tool.upload_processing.detect_markings import (
+    apply_yolo_object_detection,
+)
+from sketch_map_tool.upload_processing.inference_server import BatchedModel
+from sketch_map_tool.upload_processing.ml_models import init_yolo_obj
+from tests import FIXTURE_DIR
+
+
+def run(yolo, image, map_frame, files: int, concurrency: int) -> float:
+    """Run object detection for given number of files. Return throughput."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(apply_yolo_object_detection, image, map_frame, yolo)
+            for _ in range(files)
+        ]
+        results = [f.result() for f in futures]
+    duration = time.perf_counter() - start
+    assert all(np.array_equal(r[0], results[0][0]) for r in results)
+    return files / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=6, help="Celery workers")
+    args = parser.parse_args()
+
+    image = Image.open(FIXTURE_DIR / "map-frame-markings.png").convert("RGB")
+    map_frame = Image.open(FIXTURE_DIR / "map-frame.png").convert("RGB")
+    yolo = init_yolo_obj(CONFIG.yolo_osm_obj)
+    apply_yolo_object_detection(image, map_frame, yolo)  # warm-up
+
+    # one-at-a-time: ultralytics models are not thread-safe. Use sequential runs.
+    single = run(yolo, image, map_frame, args.files, concurrency=1)
+    batched_yolo = BatchedModel(
+        yolo,
+        CONFIG.yolo_obj_batch_size,
+        CONFIG.inference_server_batch_wait,
+    )
+    batched = run(batched_yolo, image, map_frame, args.files, args.concurrency)
+
+    print(f"files: {args.files}, concurrency: {args.concurrency}")
+    print(f"batch size: {CONFIG.yolo_obj_batch_size}")
+    print(f"batch wait: {CONFIG.inference_server_batch_wait}s")
+    print(f"one-at-a-time: {single:.2f} files/s")
+    print(f"batched:       {batched:.2f} files/s ({batched / single:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
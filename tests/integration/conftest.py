@@ -19,7 +19,7 @@ from sketch_map_tool import CELERY_CONFIG, get_locale
 from sketch_map_tool import celery_app as smt_celery_app
 from sketch_map_tool.config import CONFIG
 from sketch_map_tool.database import client_flask as db_client_flask
-from sketch_map_tool.helpers import merge, to_array, zip_
+from sketch_map_tool.helpers import iter_zip, merge, to_array
 from sketch_map_tool.models import Bbox, PaperFormat, Size
 
 # NOTE: Need to import app from routes module so that endpoints for flask test client
@@ -329,8 +329,8 @@ def uuid_digitize(
     with open(path_vector, "w") as file:
         file.write(json.dumps(merge(r[-2] for r in result)))
     with open(path_raster, "wb") as file:
-        r = zip_([r[:-2] for r in result])
-        file.write(r.getbuffer())
+        for chunk in iter_zip([r[:-2] for r in result]):
+            file.write(chunk)
     return uuid
 
 
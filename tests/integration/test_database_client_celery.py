@@ -7,6 +7,7 @@ from psycopg2.extensions import connection
 from sketch_map_tool.database import client_celery, client_flask
 from sketch_map_tool.exceptions import (
     CustomFileDoesNotExistAnymoreError,
+    CustomFileNotFoundError,
 )
 
 
@@ -97,6 +98,63 @@ def test_write_map_frame(
         assert isinstance(file, bytes)
 
 
+def test_select_map_frame(uuid_create):
+    file = client_celery.select_map_frame(UUID(uuid_create))
+    assert isinstance(file, bytes)
+
+
+def test_select_map_frame_file_not_found():
+    with pytest.raises(CustomFileNotFoundError):
+        client_celery.select_map_frame(uuid4())
+
+
+def test_select_map_frame_exists(uuid_create):
+    assert client_celery.select_map_frame_exists(UUID(uuid_create))
+    assert not client_celery.select_map_frame_exists(uuid4())
+
+
+def test_map_frame_features(
+    map_frame,
+    bbox,
+    bbox_wgs84,
+    format_,
+    orientation,
+    layer,
+):
+    uuid = uuid4()
+    client_celery.insert_map_frame(
+        map_frame, uuid, bbox, bbox_wgs84, format_, orientation, layer, b"foo"
+    )
+    assert client_celery.select_map_frame_features(uuid) == b"foo"
+    client_celery.update_map_frame_features(uuid, b"bar")
+    assert client_celery.select_map_frame_features(uuid) == b"bar"
+
+
+def test_map_frame_features_legacy(
+    map_frame,
+    bbox,
+    bbox_wgs84,
+    format_,
+    orientation,
+    layer,
+):
+    """Map frame generated before features were precomputed."""
+    uuid = uuid4()
+    client_celery.insert_map_frame(
+        map_frame, uuid, bbox, bbox_wgs84, format_, orientation, layer
+    )
+    assert client_celery.select_map_frame_features(uuid) is None
+
+
+def test_migrate(uuid_create):
+    """Column `features` is added to tables created by former versions."""
+    with client_celery.db_conn.cursor() as curs:
+        curs.execute("ALTER TABLE map_frame DROP COLUMN features")
+    client_celery.migrate()
+    assert client_celery.select_map_frame_features(UUID(uuid_create)) is None
+    client_celery.migrate()  # no-op
+
+
 def test_cleanup_map_frames_recent(
     uuid_create: str,
     map_frame: BytesIO,
@@ -174,7 +232,9 @@ def test_cleanup_map_frames_old_without_consent(
     Map frame file content should be set to null.
     """
     # TODO: Also check deletion of bbox
-    client_celery.cleanup_map_frames()
+    uuids = client_celery.cleanup_map_frames()
+    assert UUID(uuid_create) in uuids
+    assert not client_celery.select_map_frame_exists(UUID(uuid_create))
     with flask_app.app_context():
         with pytest.raises(CustomFileDoesNotExistAnymoreError):
             client_flask.select_map_frame(UUID(uuid_create))
@@ -113,6 +113,19 @@ def test_select_map_frame_file_not_found(flask_app):
             client_flask.select_map_frame(uuid4())
 
 
+def test_select_map_frame_size(flask_app, uuid_create):
+    with flask_app.app_context():
+        file = client_flask.select_map_frame(uuid_create)
+        size = client_flask.select_map_frame_size(uuid_create)
+        assert size == len(file)
+
+
+def test_select_map_frame_size_file_not_found(flask_app):
+    with flask_app.app_context():
+        with pytest.raises(CustomFileNotFoundError):
+            client_flask.select_map_frame_size(uuid4())
+
+
 def test_blob_timestamp(file_ids):
     """Test if timestamp is created when inserting data."""
     query = "SELECT ts FROM blob WHERE id = %s"
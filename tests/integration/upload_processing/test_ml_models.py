@@ -1,9 +1,25 @@
+import logging
+import time
+
+import geojson
 import pytest
+import torch
 from hypothesis import example, given
 from hypothesis.strategies import text
+from PIL import Image
+from torchvision.ops import box_iou
 
+from sketch_map_tool import tasks
 from sketch_map_tool.config import CONFIG
+from sketch_map_tool.helpers import to_array
 from sketch_map_tool.upload_processing import ml_models
+from sketch_map_tool.upload_processing.detect_markings import (
+    apply_sam,
+    apply_yolo_classification,
+    apply_yolo_object_detection,
+)
+from tests import FIXTURE_DIR
+from tests.comparator import GeoJSONComparator
 
 
 @pytest.mark.parametrize(
@@ -34,3 +50,160 @@ def test_init_model_unexpected_id(id):
     # ValueError: PosixPath('/') has an empty name
     with pytest.raises((FileNotFoundError, OSError, ValueError)):
         ml_models.init_model(id)
+
+
+#
+# Parity of exported models (ONNX, OpenVINO) with PyTorch models
+#
+# NOTE: Models need to be exported beforehand (see `scripts/export-models.py`).
+@pytest.fixture
+def image() -> Image.Image:
+    """Sketch map frame with markings."""
+    return Image.open(FIXTURE_DIR / "map-frame-markings.png").convert("RGB")
+
+
+@pytest.fixture
+def map_frame_image() -> Image.Image:
+    """Map frame without markings."""
+    return Image.open(FIXTURE_DIR / "map-frame.png").convert("RGB")
+
+
+@pytest.fixture(params=["onnx", "openvino"])
+def backend(request):
+    return request.param
+
+
+def init_exported(backend, init, *args, monkeypatch):
+    """Initialize model for given backend or skip test if model was not exported."""
+    monkeypatch.setattr(CONFIG, "ml_backend", backend)
+    try:
+        return init(*args)
+    except (FileNotFoundError, ImportError) as error:
+        pytest.skip(str(error))
+    finally:
+        monkeypatch.setattr(CONFIG, "ml_backend", "torch")
+
+
+def timed(func, *args):
+    """Run function twice (warm-up) and return result and time of second run."""
+    func(*args)
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def log_speedup(name, backend, time_torch, time_exported):
+    logging.info(
+        f"{name}: torch {time_torch:.3f}s, {backend} {time_exported:.3f}s "
+        + f"(speedup: {time_torch / time_exported:.2f}x)"
+    )
+
+
+def test_yolo_obj_parity(backend, image, map_frame_image, monkeypatch):
+    yolo_torch = ml_models.init_yolo_obj(CONFIG.yolo_osm_obj)
+    yolo_exported = init_exported(
+        backend,
+        ml_models.init_yolo_obj,
+        CONFIG.yolo_osm_obj,
+        monkeypatch=monkeypatch,
+    )
+    (bboxes_torch, _), t_torch = timed(
+        apply_yolo_object_detection, image, map_frame_image, yolo_torch
+    )
+    (bboxes_exported, _), t_exported = timed(
+        apply_yolo_object_detection, image, map_frame_image, yolo_exported
+    )
+    log_speedup("YOLO object detection", backend, t_torch, t_exported)
+
+    assert len(bboxes_torch) == len(bboxes_exported)
+    iou = box_iou(torch.tensor(bboxes_torch), torch.tensor(bboxes_exported))
+    assert (iou.max(dim=1).values > 0.9).all()
+
+
+def test_yolo_cls_parity(backend, image, map_frame_image, monkeypatch):
+    yolo_obj = ml_models.init_yolo_obj(CONFIG.yolo_osm_obj)
+    bboxes, _ = apply_yolo_object_detection(image, map_frame_image, yolo_obj)
+    yolo_torch = ml_models.init_yolo_cls(CONFIG.yolo_cls)
+    yolo_exported = init_exported(
+        backend,
+        ml_models.init_yolo_cls,
+        CONFIG.yolo_cls,
+        monkeypatch=monkeypatch,
+    )
+    labels_torch, t_torch = timed(apply_yolo_classification, image, bboxes, yolo_torch)
+    labels_exported, t_exported = timed(
+        apply_yolo_classification, image, bboxes, yolo_exported
+    )
+    log_speedup("YOLO classification", backend, t_torch, t_exported)
+
+    assert labels_torch == labels_exported
+
+
+def test_sam_parity(backend, image, map_frame_image, monkeypatch):
+    yolo_obj = ml_models.init_yolo_obj(CONFIG.yolo_osm_obj)
+    bboxes, _ = apply_yolo_object_detection(image, map_frame_image, yolo_obj)
+    sam_torch = ml_models.init_sam_predictor()
+    sam_exported = init_exported(
+        backend,
+        ml_models.init_sam_predictor,
+        monkeypatch=monkeypatch,
+    )
+    (masks_torch, _), t_torch = timed(apply_sam, image, bboxes, sam_torch)
+    (masks_exported, _), t_exported = timed(apply_sam, image, bboxes, sam_exported)
+    log_speedup("SAM", backend, t_torch, t_exported)
+
+    assert len(masks_torch) == len(masks_exported)
+    for m1, m2 in zip(masks_torch, masks_exported):
+        m1, m2 = m1.astype(bool), m2.astype(bool)
+        assert (m1 & m2).sum() / (m1 | m2).sum() > 0.9
+
+
+def test_int8_accuracy(
+    layer,
+    map_frame_marked,
+    map_frame,
+    bbox,
+    tmp_path,
+    monkeypatch,
+):
+    """Accuracy regression check of quantized (int8) models.
+
+    Digitize the sketch map of the approval test with quantized models and compare
+    the result with the approved result of the approval test (`test_approval.py`).
+
+    NOTE: Models need to be quantized beforehand (see `scripts/export-models.py`).
+    """
+    # TODO: Detection on OAM layers is not approved yet (see `test_smt_approver`).
+    if layer.startswith("oam"):
+        pytest.skip("Detection on OAM layers is not approved yet.")
+    monkeypatch.setattr(CONFIG, "ml_backend", "onnx")
+    monkeypatch.setattr(CONFIG, "ml_precision", "int8")
+    try:
+        models = {
+            "sam_predictor": ml_models.init_sam_predictor(),
+            "yolo_obj_osm": ml_models.init_yolo_obj(CONFIG.yolo_osm_obj),
+            "yolo_obj_esri": ml_models.init_yolo_obj(CONFIG.yolo_esri_obj),
+            "yolo_cls": ml_models.init_yolo_cls(CONFIG.yolo_cls),
+        }
+    except (FileNotFoundError, ImportError) as error:
+        pytest.skip(str(error))
+    for name, model in models.items():
+        monkeypatch.setattr(tasks, name, model, raising=False)
+
+    fc = tasks.digitize_sketches(
+        1,
+        "sketch_map.png",
+        to_array(map_frame.getvalue()),
+        map_frame_marked,
+        layer,
+        bbox,
+    )
+    received = tmp_path / "received.geojson"
+    received.write_text(geojson.dumps(fc))
+    approved = (
+        FIXTURE_DIR
+        / "approved"
+        / "test_approval"
+        / f"test_smt_approver[{layer}].approved.geojson"
+    )
+    assert GeoJSONComparator().compare(str(received), str(approved))
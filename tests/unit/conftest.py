@@ -10,7 +10,7 @@ from flask_babel import Babel
 from werkzeug.datastructures import FileStorage
 
 from sketch_map_tool import get_locale
-from sketch_map_tool.exceptions import QRCodeError
+from sketch_map_tool.exceptions import ClippingError, QRCodeError
 from sketch_map_tool.models import Bbox, PaperFormat, Size
 
 # NOTE: Need to import app from routes module so that endpoints for flask test client
@@ -390,3 +390,35 @@ def mock_group_result_success_failure(
     ]
     mock.get.side_effect = lambda propagate: [mock_async_result_failure.get(propagate)]
     monkeypatch.setattr("sketch_map_tool.routes.get_async_result", lambda *_: mock)
+
+
+@pytest.fixture
+def mock_async_result_unclipped():
+    """Mock task result of a sketch map which could not be clipped.
+
+    The task succeeds without raster result, but with errors.
+    """
+    mock = Mock(spec=AsyncResult)
+    mock.status = "SUCCESS"
+    mock.ready.return_value = True
+    mock.failed.return_value = False
+    mock.successful.return_value = True
+    mock.get.side_effect = lambda propagate=True: [
+        "",
+        "",
+        None,
+        geojson.FeatureCollection(features=[]),
+        [ClippingError("The sketch map could not be detected.")],
+    ]
+    return mock
+
+
+@pytest.fixture
+def mock_group_result_unclipped(mock_async_result_unclipped, monkeypatch):
+    mock = Mock(spec=GroupResult)
+    mock.ready.return_value = True
+    mock.failed.return_value = False
+    mock.successful.return_value = True
+    mock.results = [mock_async_result_unclipped]
+    mock.get.side_effect = lambda propagate=True: [mock_async_result_unclipped.get()]
+    monkeypatch.setattr("sketch_map_tool.routes.get_async_result", lambda *_: mock)
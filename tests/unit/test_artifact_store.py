@@ -0,0 +1,110 @@
+import os
+import shutil
+import time
+
+import pytest
+
+from sketch_map_tool import artifact_store
+from sketch_map_tool.artifact_store import Artifact, LocalArtifactStore
+
+
+@pytest.fixture
+def store(tmp_path) -> LocalArtifactStore:
+    return LocalArtifactStore(tmp_path / "artifacts")
+
+
+@pytest.fixture
+def file(tmp_path) -> str:
+    path = tmp_path / "file.geotiff"
+    path.write_bytes(b"foo")
+    return str(path)
+
+
+def test_local_artifact_store(store, file):
+    key = "raster-results/1.geotiff"
+    assert not store.exists(key)
+    store.put(key, file)
+    assert not os.path.exists(file)  # moved
+    assert store.exists(key)
+    assert store.size(key) == 3
+    with store.open(key) as f:
+        assert f.read() == b"foo"
+    store.delete(key)
+    assert not store.exists(key)
+
+
+def test_local_artifact_store_etag(store, file, tmp_path):
+    store.put("key", file)
+    etag = store.etag("key")
+    assert etag == store.etag("key")
+    (tmp_path / "new").write_bytes(b"foobar")
+    store.put("key", str(tmp_path / "new"))  # replace
+    assert store.etag("key") != etag
+
+
+def test_local_artifact_store_put_atomic(store, file, monkeypatch):
+    """Artifacts are not visible while being copied (e.g. across filesystems)."""
+    key = "downloads/1.zip"
+
+    def move(src, dst):
+        assert not store.exists(key)
+        shutil.copyfile(src, dst)
+        os.remove(src)
+
+    monkeypatch.setattr("sketch_map_tool.artifact_store.shutil.move", move)
+    store.put(key, file)
+    assert store.exists(key)
+    assert os.listdir(store.root / "downloads") == ["1.zip"]  # no temporary file
+
+
+def test_local_artifact_store_put_error(store, file, monkeypatch):
+    def move(*_):
+        raise OSError()
+
+    monkeypatch.setattr("sketch_map_tool.artifact_store.shutil.move", move)
+    with pytest.raises(OSError):
+        store.put("downloads/1.zip", file)
+    assert os.listdir(store.root / "downloads") == []
+
+
+def test_local_artifact_store_invalid_key(store, file):
+    with pytest.raises(ValueError):
+        store.put("../file.geotiff", file)
+
+
+def test_local_artifact_store_cleanup(store, file, tmp_path):
+    store.put("old", file)
+    (tmp_path / "new").write_bytes(b"bar")
+    store.put("new", str(tmp_path / "new"))
+    an_hour_ago = time.time() - 3600
+    os.utime(store.root / "old", (an_hour_ago, an_hour_ago))
+    store.cleanup(max_age=60)
+    assert not store.exists("old")
+    assert store.exists("new")
+
+
+def test_get_artifact_store(tmp_path, monkeypatch, file):
+    url = "file://" + str(tmp_path / "artifacts")
+    monkeypatch.setattr("sketch_map_tool.artifact_store.CONFIG.artifact_store_url", url)
+    artifact_store.get_artifact_store.cache_clear()
+    assert artifact_store.is_enabled()
+    store = artifact_store.get_artifact_store()
+    assert isinstance(store, LocalArtifactStore)
+    store.put("key", file)
+    artifact = Artifact("key")
+    assert artifact.exists()
+    assert artifact.size() == 3
+    with artifact.open() as f:
+        assert f.read() == b"foo"
+    artifact_store.get_artifact_store.cache_clear()
+
+
+def test_get_artifact_store_unsupported(monkeypatch):
+    monkeypatch.setattr(
+        "sketch_map_tool.artifact_store.CONFIG.artifact_store_url",
+        "s3://bucket",
+    )
+    artifact_store.get_artifact_store.cache_clear()
+    with pytest.raises(ValueError):
+        artifact_store.get_artifact_store()
+    artifact_store.get_artifact_store.cache_clear()
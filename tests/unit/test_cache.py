@@ -0,0 +1,60 @@
+import numpy as np
+
+from sketch_map_tool.cache import LRUCache
+
+
+def test_lru_cache_get_put():
+    cache = LRUCache(max_size=100)
+    assert cache.get("a") is None
+    value = np.zeros(10, dtype=np.uint8)
+    cache.put("a", value)
+    assert cache.get("a") is value
+    assert "a" in cache
+    assert cache.stats() == {"hits": 1, "misses": 1, "items": 1, "size": 10}
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=100)
+    cache.put("a", np.zeros(40, dtype=np.uint8))
+    cache.put("b", np.zeros(40, dtype=np.uint8))
+    cache.get("a")  # b is now least recently used
+    cache.put("c", np.zeros(40, dtype=np.uint8))
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.size == 80
+
+
+def test_lru_cache_value_too_large():
+    cache = LRUCache(max_size=100)
+    cache.put("a", np.zeros(101, dtype=np.uint8))
+    assert "a" not in cache
+    assert cache.size == 0
+
+
+def test_lru_cache_put_replaces_value():
+    cache = LRUCache(max_size=100)
+    cache.put("a", np.zeros(40, dtype=np.uint8))
+    cache.put("a", np.zeros(60, dtype=np.uint8))
+    assert len(cache) == 1
+    assert cache.size == 60
+
+
+def test_lru_cache_pop_clear():
+    cache = LRUCache(max_size=100)
+    cache.put("a", np.zeros(40, dtype=np.uint8))
+    cache.put("b", np.zeros(40, dtype=np.uint8))
+    assert cache.pop("a") is not None
+    assert cache.pop("a") is None
+    assert cache.size == 40
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_lru_cache_size_of():
+    cache = LRUCache(max_size=10, size_of=len)
+    cache.put("a", "12345")
+    cache.put("b", "123456")
+    assert "a" not in cache
+    assert cache.size == 6
@@ -1,10 +1,14 @@
+import sys
 from io import BytesIO
 from pathlib import Path
+from unittest.mock import Mock
 from zipfile import ZipFile
 
+import pytest
 from geojson import FeatureCollection
 
 from sketch_map_tool import helpers
+from sketch_map_tool.artifact_store import Artifact
 
 
 def test_get_project_root():
@@ -25,27 +29,68 @@ def test_merge_empyt_fc():
     assert len(fc.features) == 0
 
 
-def test_zip_(sketch_map_frame_markings_detected):
-    buffer = helpers.zip_(
+def test_iter_zip(tmp_path, sketch_map_frame_markings_detected):
+    path = tmp_path / "file.geotiff"
+    path.write_bytes(sketch_map_frame_markings_detected)
+    artifact = Mock(spec=Artifact)
+    artifact.open.side_effect = lambda: open(path, "rb")
+    artifact.size.side_effect = lambda: path.stat().st_size
+    chunks = helpers.iter_zip(
         [
-            (
-                "file_name.png",
-                "attribution",
-                BytesIO(sketch_map_frame_markings_detected),
-            ),
+            ("file_name.png", "attribution", artifact),
             (
                 "file_name_2.png",
                 "attribution",
                 BytesIO(sketch_map_frame_markings_detected),
             ),
-        ]
+        ],
+        chunk_size=1024**2,
     )
-    with ZipFile(buffer) as zip_file:
+    chunks = list(chunks)
+    assert len(chunks) > 2
+    with ZipFile(BytesIO(b"".join(chunks))) as zip_file:
+        assert zip_file.testzip() is None
         zip_info = zip_file.infolist()
-    assert len(zip_info) == 3
-    assert zip_info[0].filename == "file_name.geotiff"
+        assert zip_file.read("file_name.geotiff") == path.read_bytes()
+    assert [i.filename for i in zip_info] == [
+        "file_name.geotiff",
+        "file_name_2.geotiff",
+        "attributions.txt",
+    ]
     assert zip_info[0].file_size == 5407584
-    assert zip_info[1].filename == "file_name_2.geotiff"
     assert zip_info[1].file_size == 5407584
-    assert zip_info[2].filename == "attributions.txt"
     assert zip_info[2].file_size == 11
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="Reads from /proc (Linux only)")
+def test_get_memory_usage():
+    usage = helpers.get_memory_usage()
+    assert usage.keys() == {"rss", "pss", "uss"}
+    assert usage["rss"] >= usage["pss"] >= usage["uss"] > 0
+
+
+def test_get_transformer():
+    transformer = helpers.get_transformer("EPSG:3857", "EPSG:4326", always_xy=True)
+    assert transformer is helpers.get_transformer(
+        "EPSG:3857",
+        "EPSG:4326",
+        always_xy=True,
+    )
+    assert transformer is not helpers.get_transformer("EPSG:3857", "EPSG:4326")
+    lon, lat = transformer.transform(0, 0)
+    assert lon == pytest.approx(0)
+    assert lat == pytest.approx(0)
+
+
+@pytest.mark.parametrize(
+    "result,expected",
+    (
+        (["", "", BytesIO(), FeatureCollection([]), []], False),
+        (["", "", None, FeatureCollection([]), [Mock()]], True),
+        (BytesIO(), False),  # legacy raster result
+    ),
+)
+def test_is_unclipped(result, expected):
+    async_result = Mock(**{"successful.return_value": True, "get.return_value": result})
+    assert helpers.is_unclipped(async_result) is expected
+    assert helpers.is_failed(async_result) is expected
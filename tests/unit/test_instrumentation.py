@@ -0,0 +1,67 @@
+import json
+import logging
+import time
+
+from sketch_map_tool import instrumentation
+from sketch_map_tool.instrumentation import log_stages, record_stages, stage
+
+
+def test_record_stages():
+    with record_stages() as stages:
+        with stage("a"):
+            time.sleep(0.01)
+        for _ in range(3):
+            with stage("b"):
+                pass
+    result = stages.to_dict()
+    assert list(result.keys()) == ["a", "b"]
+    assert result["a"]["count"] == 1
+    assert result["a"]["wall_time"] >= 0.01
+    assert result["b"]["count"] == 3
+    for s in result.values():
+        assert s["cpu_time"] >= 0
+        assert s["peak_rss"] > 0
+
+
+def test_record_stages_callback():
+    published = []
+    with record_stages(callback=lambda s: published.append(s.to_dict())) as stages:
+        with stage("a"):
+            pass
+        with stage("b"):
+            pass
+    assert [list(p.keys()) for p in published] == [["a"], ["a", "b"]]
+    assert published[-1] == stages.to_dict()
+
+
+def test_stage_outside_of_record_stages():
+    with stage("a"):
+        pass
+    with record_stages() as stages:
+        pass
+    assert stages.to_dict() == {}
+
+
+def test_stage_exception():
+    with record_stages() as stages:
+        try:
+            with stage("a"):
+                raise ValueError()
+        except ValueError:
+            pass
+    assert stages.to_dict()["a"]["count"] == 1
+
+
+def test_log_stages(caplog):
+    with record_stages() as stages:
+        with stage("a"):
+            pass
+    with caplog.at_level(logging.INFO):
+        log_stages(stages, task_id="foo")
+    record = json.loads(caplog.records[-1].message)
+    assert record["task_id"] == "foo"
+    assert record["stages"]["a"]["count"] == 1
+
+
+def test_get_peak_rss():
+    assert instrumentation.get_peak_rss() > 0
@@ -1,7 +1,8 @@
-from io import BytesIO
-
 import pytest
 
+from sketch_map_tool import artifact_store
+from sketch_map_tool.tasks import get_download_key
+
 
 @pytest.mark.usefixtures("mock_async_result_success_sketch_map")
 def test_download_success(client, uuid):
@@ -36,8 +37,8 @@ def test_group_download_success(client, uuid, type_, monkeypatch):
         lambda *_: {"type": "FeatureCollection", "features": []},
     )
     monkeypatch.setattr(
-        "sketch_map_tool.routes.zip_",
-        lambda *_: BytesIO(),
+        "sketch_map_tool.routes.iter_zip",
+        lambda *_: iter([b""]),
     )
     resp = client.get("/api/download/{0}/{1}".format(uuid, type_))
     assert resp.status_code == 200
@@ -70,6 +71,19 @@ def test_group_failure(client, uuid, type_):
     assert resp.status_code == 500
 
 
+@pytest.mark.usefixtures("mock_group_result_unclipped")
+@pytest.mark.parametrize(
+    "type_",
+    (
+        "raster-results",
+        "vector-results",
+    ),
+)
+def test_group_unclipped(client, uuid, type_):
+    resp = client.get("/api/download/{0}/{1}".format(uuid, type_))
+    assert resp.status_code == 500
+
+
 @pytest.mark.usefixtures("mock_group_result_started_success_failure")
 @pytest.mark.parametrize(
     "type_",
@@ -102,10 +116,42 @@ def test_group_success_failure(
         lambda *_: {"type": "FeatureCollection", "features": []},
     )
     monkeypatch.setattr(
-        "sketch_map_tool.routes.zip_",
-        lambda *_: BytesIO(),
+        "sketch_map_tool.routes.iter_zip",
+        lambda *_: iter([b""]),
     )
 
     resp = client.get("/api/download/{0}/{1}".format(uuid, type_))
     assert resp.status_code == 200
     assert resp.mimetype in ["application/zip", "application/geo+json"]
+
+
+@pytest.mark.usefixtures("mock_group_result_success")
+@pytest.mark.parametrize(
+    "type_",
+    (
+        "raster-results",
+        "vector-results",
+    ),
+)
+def test_group_download_assembled(client, uuid, type_, tmp_path, monkeypatch):
+    """Downloads assembled by `assemble_results` are served from artifact store."""
+    url = "file://" + str(tmp_path / "artifacts")
+    monkeypatch.setattr("sketch_map_tool.artifact_store.CONFIG.artifact_store_url", url)
+    artifact_store.get_artifact_store.cache_clear()
+    (tmp_path / "download").write_bytes(b"foo")
+    artifact_store.get_artifact_store().put(
+        get_download_key(uuid, type_),
+        str(tmp_path / "download"),
+    )
+
+    resp = client.get("/api/download/{0}/{1}".format(uuid, type_))
+    assert resp.status_code == 200
+    assert resp.data == b"foo"
+    assert resp.headers["ETag"]
+
+    resp = client.get(
+        "/api/download/{0}/{1}".format(uuid, type_),
+        headers={"If-None-Match": resp.headers["ETag"]},
+    )
+    assert resp.status_code == 304
+    artifact_store.get_artifact_store.cache_clear()
@@ -231,3 +231,21 @@ def test_group_status_success_failure(
     assert resp.json["errors"] == [lang[1]]
     assert resp.json["href"] == "/api/download/{0}/{1}".format(uuid, type_)
     assert "info" not in resp.json.keys()
+
+
+@pytest.mark.parametrize(
+    "type_",
+    (
+        "raster-results",
+        "vector-results",
+    ),
+)
+def test_group_status_unclipped(client, uuid, type_, mock_group_result_unclipped):
+    """Sketch map could not be clipped: Task succeeded, but returned an error."""
+    resp = client.get("/api/status/{0}/{1}".format(uuid, type_))
+    assert resp.status_code == 422
+    assert resp.json["status"] == "FAILURE"
+    assert resp.json["errors"] == [
+        "ClippingError: The sketch map could not be detected."
+    ]
+    assert "href" not in resp.json.keys()
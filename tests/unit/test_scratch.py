@@ -0,0 +1,48 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from sketch_map_tool import scratch
+
+
+@pytest.fixture
+def scratch_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr("sketch_map_tool.scratch.CONFIG.scratch_dir", str(tmp_path))
+    return tmp_path
+
+
+def test_is_enabled(scratch_dir, monkeypatch):
+    assert scratch.is_enabled()
+    monkeypatch.setattr("sketch_map_tool.scratch.CONFIG.scratch_dir", "")
+    assert not scratch.is_enabled()
+
+
+def test_create_file(scratch_dir):
+    path = scratch.create_file(suffix=".geotiff")
+    assert path.startswith(str(scratch_dir))
+    assert path.endswith(".geotiff")
+    assert not os.path.exists(path)
+
+
+def test_create_array(scratch_dir):
+    array = scratch.create_array((100, 200, 3), np.uint8)
+    assert isinstance(array, np.memmap)
+    assert array.shape == (100, 200, 3)
+    array[:] = 255
+    assert array.all()
+    assert list(scratch_dir.iterdir()) == []  # anonymous file
+
+
+def test_cleanup(scratch_dir):
+    old = scratch.create_file()
+    new = scratch.create_file()
+    for path in (old, new):
+        with open(path, "wb") as f:
+            f.write(b"foo")
+    an_hour_ago = time.time() - 3600
+    os.utime(old, (an_hour_ago, an_hour_ago))
+    scratch.cleanup(max_age=60)
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
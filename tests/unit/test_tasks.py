@@ -1,12 +1,21 @@
 """Test tasks without using the tasks queue Celery."""
 
+import json
 from io import BytesIO
+from unittest.mock import Mock
+from uuid import UUID
+from zipfile import ZipFile
 
 import fitz
+import pytest
 from fitz import Page
+from geojson import Feature, FeatureCollection, Point
 from pytest_approval import verify_image
 
-from sketch_map_tool import tasks
+from sketch_map_tool import artifact_store, tasks
+from sketch_map_tool.cache import LRUCache
+from sketch_map_tool.instrumentation import record_stages, stage
+from tests import FIXTURE_DIR
 from tests import vcr_app as vcr
 
 
@@ -44,3 +53,118 @@ def test_generate_sketch_map(
         page: Page = doc.load_page(0)
         image = page.get_pixmap()
     assert verify_image(image.tobytes(), extension=".png", content_only=True)
+
+
+@pytest.fixture
+def map_frame_db(monkeypatch):
+    """Mock database of map frames. Returns UUIDs of selected map frames."""
+    calls = []
+    exists = {"value": True}
+
+    def select_map_frame(uuid):
+        calls.append(uuid)
+        return (FIXTURE_DIR / "map-frame.png").read_bytes()
+
+    monkeypatch.setattr(
+        "sketch_map_tool.tasks.db_client_celery.select_map_frame",
+        select_map_frame,
+    )
+    monkeypatch.setattr(
+        "sketch_map_tool.tasks.db_client_celery.select_map_frame_exists",
+        lambda _: exists["value"],
+    )
+    monkeypatch.setattr("sketch_map_tool.tasks.map_frame_cache", LRUCache(10**9))
+    return calls, exists
+
+
+def test_get_map_frame(map_frame_db):
+    calls, _ = map_frame_db
+    uuid = "654dde2a-7a3c-4a77-8d2a-8c0f4b6fd09a"
+    map_frame = tasks.get_map_frame(uuid)
+    assert map_frame.ndim == 3
+    assert not map_frame.flags.writeable
+    assert tasks.get_map_frame(uuid) is map_frame
+    assert len(calls) == 1  # cached
+    assert tasks.map_frame_cache.stats()["hits"] == 1
+
+
+def test_get_map_frame_cleaned_up(map_frame_db):
+    """Map frame cleaned up by another worker process is evicted."""
+    calls, exists = map_frame_db
+    uuid = "654dde2a-7a3c-4a77-8d2a-8c0f4b6fd09a"
+    map_frame = tasks.get_map_frame(uuid)
+    exists["value"] = False
+    assert tasks.get_map_frame(uuid) is not map_frame
+    assert len(calls) == 2
+
+
+def test_cleanup_map_frames_evicts_cache(map_frame_db, monkeypatch):
+    uuid = "654dde2a-7a3c-4a77-8d2a-8c0f4b6fd09a"
+    tasks.get_map_frame(uuid)
+    monkeypatch.setattr(
+        "sketch_map_tool.tasks.db_client_celery.cleanup_map_frames",
+        lambda: [UUID(uuid)],
+    )
+    tasks.cleanup_map_frames()
+    assert (uuid, "map_frame") not in tasks.map_frame_cache
+
+
+@pytest.fixture
+def local_artifact_store(tmp_path, monkeypatch):
+    url = "file://" + str(tmp_path / "artifacts")
+    monkeypatch.setattr("sketch_map_tool.artifact_store.CONFIG.artifact_store_url", url)
+    artifact_store.get_artifact_store.cache_clear()
+    yield artifact_store.get_artifact_store()
+    artifact_store.get_artifact_store.cache_clear()
+
+
+def test_assemble_results(local_artifact_store):
+    uuid = "654dde2a-7a3c-4a77-8d2a-8c0f4b6fd09a"
+    results = [
+        (
+            "file_name.png",
+            "attribution",
+            BytesIO(b"foo"),
+            FeatureCollection([Feature(geometry=Point((1.0, 2.0)))]),
+            [],
+        ),
+    ]
+    tasks.assemble_results(results, uuid)
+    with local_artifact_store.open(tasks.get_download_key(uuid, "raster-results")) as f:
+        with ZipFile(f) as zip_file:
+            assert zip_file.read("file_name.geotiff") == b"foo"
+    with local_artifact_store.open(tasks.get_download_key(uuid, "vector-results")) as f:
+        fc = json.load(f)
+    assert len(fc["features"]) == 1
+
+
+def test_assemble_results_unclipped(local_artifact_store):
+    """Sketch maps which could not be clipped have no raster result."""
+    uuid = "654dde2a-7a3c-4a77-8d2a-8c0f4b6fd09a"
+    results = [
+        ("file_name.png", "attribution", BytesIO(b"foo"), FeatureCollection([]), []),
+        ("unclipped.png", "attribution", None, FeatureCollection([]), [Mock()]),
+    ]
+    tasks.assemble_results(results, uuid)
+    with local_artifact_store.open(tasks.get_download_key(uuid, "raster-results")) as f:
+        with ZipFile(f) as zip_file:
+            assert zip_file.namelist() == ["file_name.geotiff", "attributions.txt"]
+
+
+def test_cleanup_worker_scratch(monkeypatch):
+    cleanup = Mock()
+    monkeypatch.setattr("sketch_map_tool.tasks.scratch.cleanup", cleanup)
+    tasks.cleanup_worker_scratch()
+    cleanup.assert_called_once_with(tasks.celery.conf.task_time_limit)
+
+
+def test_publish_stages():
+    task = Mock()
+    callback = tasks.publish_stages(task, interval=60)
+    with record_stages(callback=callback):
+        with stage("a"):
+            pass
+        with stage("b"):  # throttled
+            pass
+    task.update_state.assert_called_once()
+    assert list(task.update_state.call_args.kwargs["meta"]["stages"]) == ["a"]
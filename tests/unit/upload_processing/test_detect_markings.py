@@ -0,0 +1,202 @@
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from sketch_map_tool.upload_processing.detect_markings import (
+    apply_ml_pipeline,
+    apply_sam,
+    apply_yolo_classification,
+    cluster_bounding_boxes,
+    masks_from_bboxes,
+    post_process,
+)
+
+
+@pytest.fixture
+def image():
+    return Image.fromarray(np.zeros((100, 100, 3), dtype=np.uint8))
+
+
+@pytest.fixture
+def bounding_boxes():
+    return np.array([[i, i, i + 10, i + 10] for i in range(0, 50, 5)], dtype=float)
+
+
+@pytest.fixture
+def yolo_cls():
+    """Mock of a YOLO classifier returning the index of the image in the batch."""
+    counter = iter(range(1000))
+
+    def predict(images):
+        return [Mock(probs=Mock(top1=next(counter))) for _ in images]
+
+    return Mock(side_effect=predict)
+
+
+@pytest.mark.parametrize("batch_size", (1, 3, 10, 16))
+def test_apply_yolo_classification_batched(
+    image,
+    bounding_boxes,
+    yolo_cls,
+    batch_size,
+    monkeypatch,
+):
+    monkeypatch.setattr(
+        "sketch_map_tool.upload_processing.detect_markings.CONFIG.yolo_cls_batch_size",
+        batch_size,
+    )
+    labels = apply_yolo_classification(image, bounding_boxes, yolo_cls)
+    assert labels == list(range(len(bounding_boxes)))
+    assert yolo_cls.call_count == -(-len(bounding_boxes) // batch_size)  # ceil
+    for call in yolo_cls.call_args_list:
+        assert len(call.args[0]) <= batch_size
+
+
+def test_apply_yolo_classification_no_bounding_boxes(image, yolo_cls):
+    labels = apply_yolo_classification(image, np.empty((0, 4)), yolo_cls)
+    assert labels == []
+    yolo_cls.assert_not_called()
+
+
+@pytest.fixture
+def sam_predictor():
+    """Mock of SAM predictor returning one mask per bounding box.
+
+    Mimics the output shapes of `SAM2ImagePredictor.predict`, which squeezes the
+    batch dimension if only one bounding box is given.
+    """
+
+    def predict(box, multimask_output):
+        masks = np.stack([np.full((100, 100), b[0], dtype=np.float32) for b in box])
+        scores = box[:, 0].astype(np.float32)
+        if len(box) == 1:
+            return masks, scores, None
+        return masks[:, None], scores[:, None], None
+
+    return Mock(predict=Mock(side_effect=predict))
+
+
+@pytest.mark.parametrize("n", (1, 2, 10))
+def test_masks_from_bboxes(bounding_boxes, sam_predictor, n):
+    masks, scores = masks_from_bboxes(bounding_boxes[:n], sam_predictor)
+    assert len(masks) == len(scores) == n
+    for mask, score, bbox in zip(masks, scores, bounding_boxes):
+        assert mask.shape == (100, 100)
+        assert (mask == bbox[0]).all()
+        assert score == bbox[0]
+
+
+@pytest.mark.parametrize("batch_size", (1, 3, 16))
+def test_apply_sam_batched(
+    image,
+    bounding_boxes,
+    sam_predictor,
+    batch_size,
+    monkeypatch,
+):
+    monkeypatch.setattr(
+        "sketch_map_tool.upload_processing.detect_markings.CONFIG.sam_batch_size",
+        batch_size,
+    )
+    masks, scores = apply_sam(image, bounding_boxes, sam_predictor)
+    assert scores == list(bounding_boxes[:, 0])
+    assert len(masks) == len(bounding_boxes)
+    assert sam_predictor.set_image.call_count == 1
+    assert sam_predictor.predict.call_count == -(-len(bounding_boxes) // batch_size)
+
+
+def test_cluster_bounding_boxes():
+    bounding_boxes = np.array(
+        [
+            [10, 10, 20, 20],
+            [25, 25, 35, 35],  # overlaps with first box after padding
+            [80, 80, 90, 90],
+        ],
+        dtype=float,
+    )
+    regions = cluster_bounding_boxes(bounding_boxes, (100, 100))
+    assert regions == [((0, 0, 51, 51), [0, 1]), ((64, 64, 100, 100), [2])]
+
+
+@pytest.fixture
+def sam_predictor_roi():
+    """Mock of SAM predictor returning masks of the size of the image set last."""
+    predictor = Mock()
+
+    def set_image(image):
+        predictor.shape = image.shape[:2]
+
+    def predict(box, multimask_output):
+        masks = np.ones((len(box), 1, *predictor.shape), dtype=np.float32)
+        return masks, np.ones((len(box), 1), dtype=np.float32), None
+
+    predictor.set_image = Mock(side_effect=set_image)
+    predictor.predict = Mock(side_effect=predict)
+    return predictor
+
+
+def test_apply_sam_roi(image, sam_predictor_roi, monkeypatch):
+    monkeypatch.setattr(
+        "sketch_map_tool.upload_processing.detect_markings.CONFIG.sam_encoding",
+        "roi",
+    )
+    bounding_boxes = np.array([[10, 10, 20, 20], [80, 80, 90, 90]], dtype=float)
+    masks, scores = apply_sam(image, bounding_boxes, sam_predictor_roi)
+    assert sam_predictor_roi.set_image.call_count == 2
+    assert len(masks) == len(scores) == 2
+    for mask, (x0, y0, x1, y1) in zip(masks, [(0, 0, 36, 36), (64, 64, 100, 100)]):
+        assert mask.shape == (100, 100)
+        assert mask.sum() == mask[y0:y1, x0:x1].size
+        assert mask[y0:y1, x0:x1].all()
+
+
+def test_apply_sam_roi_fallback(image, sam_predictor_roi, monkeypatch):
+    monkeypatch.setattr(
+        "sketch_map_tool.upload_processing.detect_markings.CONFIG.sam_encoding",
+        "roi",
+    )
+    # regions of interest cover most of the image
+    bounding_boxes = np.array([[10, 10, 90, 90]], dtype=float)
+    masks, _ = apply_sam(image, bounding_boxes, sam_predictor_roi)
+    sam_predictor_roi.set_image.assert_called_once()
+    assert sam_predictor_roi.set_image.call_args.args[0].shape == (100, 100, 3)
+    assert masks[0].all()
+
+
+def test_apply_sam_roi_fallback_max_regions(image, sam_predictor_roi, monkeypatch):
+    monkeypatch.setattr(
+        "sketch_map_tool.upload_processing.detect_markings.CONFIG.sam_encoding",
+        "roi",
+    )
+    monkeypatch.setattr(
+        "sketch_map_tool.upload_processing.detect_markings.CONFIG.sam_roi_max_regions",
+        1,
+    )
+    bounding_boxes = np.array([[10, 10, 20, 20], [80, 80, 90, 90]], dtype=float)
+    masks, _ = apply_sam(image, bounding_boxes, sam_predictor_roi)
+    sam_predictor_roi.set_image.assert_called_once()
+    assert sam_predictor_roi.set_image.call_args.args[0].shape == (100, 100, 3)
+    assert len(masks) == 2
+
+
+def test_apply_ml_pipeline_no_detections(image, yolo_cls, sam_predictor):
+    boxes = Mock(xyxy=torch.empty((0, 4)), cls=torch.empty((0,)))
+    yolo_obj = Mock(predict=Mock(return_value=[Mock(boxes=boxes)]))
+    masks, bboxes, colors = apply_ml_pipeline(
+        image,
+        image,
+        yolo_obj,
+        yolo_cls,
+        sam_predictor,
+    )
+    assert masks == colors == []
+    assert len(bboxes) == 0
+    yolo_cls.assert_not_called()
+    sam_predictor.set_image.assert_not_called()
+
+
+def test_post_process_no_masks():
+    assert post_process([], np.empty((0, 4)), []) == []
@@ -1,9 +1,15 @@
 from io import BytesIO
 from tempfile import NamedTemporaryFile
 
+import numpy as np
+import pytest
 from osgeo import gdal, osr
 
 from sketch_map_tool.upload_processing import georeference
+from sketch_map_tool.upload_processing.georeference import (
+    crop_to_content,
+    get_bounding_rect,
+)
 
 
 def test_georeference_map_frame(map_frame, bbox):
@@ -55,3 +61,38 @@ def test_georeference_markings_detected(sketch_map_frame_markings_detected, bbox
     # cv2.imshow("image", img)
     # cv2.waitKey(0)
     # cv2.destroyAllWindows()
+
+
+def test_georeference_no_vsimem_files_left(map_frame, bbox):
+    georeference(map_frame, bbox)
+    files = gdal.ReadDir("/vsimem/") or []
+    assert not any(f.startswith("georeference-") for f in files)
+
+
+def test_crop_to_content(bbox):
+    img = np.zeros((100, 200), dtype=np.uint8)
+    img[10:20, 50:150] = 1
+    cropped, cropped_bbox = crop_to_content(img, bbox)
+    assert cropped.shape == (10, 100)
+    assert cropped.all()
+    pixel_width = (bbox.lon_max - bbox.lon_min) / 200
+    pixel_height = (bbox.lat_max - bbox.lat_min) / 100
+    assert cropped_bbox.lon_min == pytest.approx(bbox.lon_min + 50 * pixel_width)
+    assert cropped_bbox.lon_max == pytest.approx(bbox.lon_min + 150 * pixel_width)
+    assert cropped_bbox.lat_max == pytest.approx(bbox.lat_max - 10 * pixel_height)
+    assert cropped_bbox.lat_min == pytest.approx(bbox.lat_max - 20 * pixel_height)
+
+
+def test_crop_to_content_empty(bbox):
+    img = np.zeros((100, 200), dtype=np.uint8)
+    cropped, cropped_bbox = crop_to_content(img, bbox)
+    assert cropped is img
+    assert cropped_bbox == bbox
+
+
+def test_get_bounding_rect():
+    img = np.zeros((100, 200, 3), dtype=np.uint8)
+    assert get_bounding_rect(img) is None
+    img[5, 7, 2] = 255
+    img[9, 3, 0] = 255
+    assert get_bounding_rect(img) == (3, 5, 8, 10)
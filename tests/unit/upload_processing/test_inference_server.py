@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from multiprocessing import AuthenticationError
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from sketch_map_tool.upload_processing import inference_server
+from sketch_map_tool.upload_processing.inference_server import (
+    BoundedSamPredictor,
+    InferenceClient,
+    InferenceServer,
+    MicroBatcher,
+    pack_marking,
+    unpack_marking,
+)
+
+
+def test_micro_batcher():
+    func = Mock(side_effect=lambda items: [i * 2 for i in items])
+    batcher = MicroBatcher(func, max_batch_size=8, max_wait=0.5)
+    results = {}
+
+    def submit(i):
+        results[i] = batcher.submit([i, i + 100])
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {i: [i * 2, (i + 100) * 2] for i in range(4)}
+    # items of concurrent threads are processed together
+    assert func.call_count < 4
+    for call in func.call_args_list:
+        assert len(call.args[0]) <= 8
+
+
+def test_micro_batcher_error():
+    batcher = MicroBatcher(Mock(side_effect=ValueError), 8, 0)
+    with pytest.raises(ValueError):
+        batcher.submit([1])
+
+
+def test_micro_batcher_item_error():
+    """Only submissions of failing items fail."""
+
+    def func(items):
+        if -1 in items:
+            raise ValueError
+        return items
+
+    batcher = MicroBatcher(func, max_batch_size=8, max_wait=0.5)
+    results = {}
+
+    def submit(i):
+        try:
+            results[i] = batcher.submit([i])
+        except ValueError as error:
+            results[i] = error
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in (1, -1, 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results[1] == [1]
+    assert results[2] == [2]
+    assert isinstance(results[-1], ValueError)
+
+
+def test_bounded_sam_predictor():
+    running = []
+    max_running = []
+
+    def set_image(_):
+        running.append(1)
+        max_running.append(len(running))
+        time.sleep(0.05)
+        running.pop()
+
+    semaphore = threading.BoundedSemaphore(2)
+    predictors = [
+        BoundedSamPredictor(Mock(set_image=set_image), semaphore) for _ in range(4)
+    ]
+    threads = [threading.Thread(target=p.set_image, args=(None,)) for p in predictors]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(max_running) == 4
+    assert max(max_running) <= 2
+
+
+@pytest.mark.parametrize("color", (0, 1, 5))
+def test_pack_unpack_marking(color):
+    marking = np.zeros((13, 7), dtype=np.uint8)
+    marking[2:5, 3:6] = color
+    unpacked = unpack_marking(*pack_marking(marking))
+    assert unpacked.dtype == np.uint8
+    np.testing.assert_array_equal(unpacked, marking)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """Inference server with mocked ml-models running in a background thread."""
+
+    def detect_markings(sketch_map_frame, *_):
+        return [sketch_map_frame[:, :, 0]]
+
+    monkeypatch.setattr(inference_server, "detect_markings", detect_markings)
+    monkeypatch.setattr(inference_server, "clone_sam_predictor", Mock())
+    monkeypatch.setattr(inference_server.CONFIG, "inference_server_authkey", "key")
+    address = str(tmp_path / "inference.sock")
+    server = InferenceServer(address, Mock(), Mock(), Mock(), Mock())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for _ in range(100):  # wait for server to listen
+        if (tmp_path / "inference.sock").exists():
+            break
+        time.sleep(0.01)
+    return server
+
+
+def test_inference_client(server):
+    client = InferenceClient(server.address)
+    sketch_map_frame = np.zeros((10, 10, 3), dtype=np.uint8)
+    sketch_map_frame[2:4, 2:4] = 3
+    for _ in range(2):  # connection is reused
+        markings = client.detect_markings(sketch_map_frame, sketch_map_frame, "osm")
+        assert len(markings) == 1
+        np.testing.assert_array_equal(markings[0], sketch_map_frame[:, :, 0])
+
+
+def test_inference_client_error(server):
+    client = InferenceClient(server.address)
+    frame = np.zeros((10, 10, 3), dtype=np.uint8)
+    with pytest.raises(ValueError, match="Unexpected layer"):
+        client.detect_markings(frame, frame, "foo")
+
+
+def test_inference_client_timeout(server, monkeypatch):
+    def detect_markings(*_):
+        time.sleep(1)
+        return []
+
+    monkeypatch.setattr(inference_server, "detect_markings", detect_markings)
+    monkeypatch.setattr(inference_server.CONFIG, "inference_server_timeout", 0.1)
+    client = InferenceClient(server.address)
+    frame = np.zeros((10, 10, 3), dtype=np.uint8)
+    with pytest.raises(TimeoutError):
+        client.detect_markings(frame, frame, "osm")
+    assert client.connection is None  # reconnect on next request
+
+
+def test_inference_server_socket_mode(server):
+    assert os.stat(server.address).st_mode & 0o777 == 0o600
+
+
+def test_inference_client_wrong_authkey(server, monkeypatch):
+    monkeypatch.setattr(inference_server.CONFIG, "inference_server_authkey", "foo")
+    client = InferenceClient(server.address)
+    frame = np.zeros((10, 10, 3), dtype=np.uint8)
+    with pytest.raises(AuthenticationError):
+        client.detect_markings(frame, frame, "osm")
+
+
+def test_get_authkey_missing(monkeypatch):
+    monkeypatch.setattr(inference_server.CONFIG, "inference_server_authkey", "")
+    with pytest.raises(ValueError):
+        inference_server.get_authkey()
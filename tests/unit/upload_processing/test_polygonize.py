@@ -1,9 +1,123 @@
-from geojson import FeatureCollection
+from copy import deepcopy
 
-from sketch_map_tool.upload_processing import polygonize
+import geojson
+import numpy as np
+import pytest
+from geojson import Feature, FeatureCollection, Point, Polygon
+from pyproj import Transformer
+from shapely.geometry import shape
+
+from sketch_map_tool.upload_processing import georeference, polygonize
+from sketch_map_tool.upload_processing.polygonize import (
+    create_label_rasters,
+    polygonize_markings,
+    transform,
+)
+
+
+@pytest.fixture
+def markings() -> list:
+    """Markings with different colors. The last two markings overlap."""
+    shape = (200, 300)
+    markings = []
+    for color, (y0, y1, x0, x1) in [
+        (1, (10, 50, 10, 50)),
+        (2, (60, 80, 100, 250)),
+        (3, (100, 190, 20, 120)),
+        (2, (150, 180, 100, 200)),
+    ]:
+        marking = np.zeros(shape, dtype=np.uint8)
+        marking[y0:y1, x0:x1] = color
+        markings.append(marking)
+    markings[0][20:30, 20:30] = 0  # hole
+    markings[1][65:70, 240:245] = 0  # hole touching the border of the marking
+    return markings
 
 
 def test_polygonize(sketch_map_frame_markings_detected_buffer):
     fc = polygonize(sketch_map_frame_markings_detected_buffer, "red")
     assert fc.is_valid
     assert isinstance(fc, FeatureCollection)
+
+
+def test_create_label_rasters(markings):
+    label_rasters = create_label_rasters(markings)
+    assert len(label_rasters) == 2  # one overlap
+    assert set(np.unique(label_rasters[0])) == {0, 1, 2, 3}
+    assert set(np.unique(label_rasters[1])) == {0, 4}
+
+
+def test_create_label_rasters_empty_marking(markings):
+    markings.append(np.zeros(markings[0].shape, dtype=np.uint8))
+    label_rasters = create_label_rasters(markings)
+    assert len(label_rasters) == 2
+    assert all(5 not in labels for labels in label_rasters)
+
+
+def test_polygonize_markings(markings, bbox):
+    """Same result as polygonizing each marking on its own (incl. overlaps)."""
+    fcs = polygonize_markings(markings, bbox, "red")
+    assert len(fcs) == len(markings)
+    for marking, fc in zip(markings, fcs):
+        assert isinstance(fc, FeatureCollection)
+        assert fc.is_valid
+        expected = polygonize(georeference(marking, bbox, bgr=False), "red")
+        expected = [f for f in expected["features"] if f["properties"]["color"] != "0"]
+        assert len(fc["features"]) == len(expected)
+        for feature, expected_feature in zip(fc["features"], expected):
+            assert feature["properties"] == expected_feature["properties"]
+            # polygonized raster is cropped to the markings
+            assert shape(feature["geometry"]).equals_exact(
+                shape(expected_feature["geometry"]),
+                tolerance=1e-9,
+            )
+
+
+def test_polygonize_markings_empty(bbox):
+    assert polygonize_markings([], bbox, "red") == []
+    marking = np.zeros((100, 100), dtype=np.uint8)
+    assert polygonize_markings([marking], bbox, "red") == [FeatureCollection([])]
+
+
+def test_transform():
+    fc = geojson.loads(
+        geojson.dumps(
+            FeatureCollection(
+                [
+                    Feature(geometry=Point((964472.0, 6343459.0))),
+                    Feature(
+                        geometry=Polygon(
+                            [
+                                [(0.0, 0.0), (1e5, 0.0), (1e5, 1e5), (0.0, 0.0)],
+                                [(1e4, 1e3), (2e4, 1e3), (2e4, 2e3), (1e4, 1e3)],
+                            ]
+                        )
+                    ),
+                    Feature(geometry=None),
+                ]
+            )
+        )
+    )
+    transformer = Transformer.from_crs("EPSG:3857", "EPSG:4326", always_xy=True)
+    expected = geojson.utils.map_tuples(
+        lambda c: transformer.transform(c[0], c[1]),
+        deepcopy(fc),
+    )
+    result = transform(fc)
+    assert result is fc  # in-place
+    assert result.is_valid
+    for feature, expected_feature in zip(result["features"], expected["features"]):
+        if expected_feature["geometry"] is None:
+            assert feature["geometry"] is None
+            continue
+        assert np.allclose(
+            np.array(list(geojson.utils.coords(feature))),
+            np.array(list(geojson.utils.coords(expected_feature))),
+        )
+    assert result["features"][1]["geometry"]["type"] == "Polygon"
+    assert len(result["features"][1]["geometry"]["coordinates"]) == 2
+
+
+def test_transform_empty():
+    fc = FeatureCollection([])
+    assert transform(fc) == FeatureCollection([])
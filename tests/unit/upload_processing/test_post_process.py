@@ -1,11 +1,14 @@
 import geojson
 import pytest
-from geojson import FeatureCollection
+from geojson import Feature, FeatureCollection, MultiPolygon, Point, Polygon
 
 from sketch_map_tool.upload_processing.post_process import (
     classify_points,
     clean,
     enrich,
+    post_process,
+    simplify,
+    smooth,
 )
 from tests import FIXTURE_DIR
 
@@ -56,3 +59,61 @@ def test_classify_points_no_points(detected_markings, bbox):
         if r.geometry.type == "Point":
             number_of_points = number_of_points + 1
     assert number_of_points == 0
+
+
+@pytest.fixture
+def marking_fc() -> FeatureCollection:
+    """Polygonized marking (EPSG:4326) with a hole and background."""
+    square = [(8.67, 49.41), (8.68, 49.41), (8.68, 49.42), (8.67, 49.42), (8.67, 49.41)]
+    hole = [
+        (8.672, 49.412),
+        (8.673, 49.412),
+        (8.673, 49.413),
+        (8.672, 49.412),
+    ]
+    small = [  # close to the square
+        (8.681, 49.415),
+        (8.682, 49.415),
+        (8.682, 49.416),
+        (8.681, 49.415),
+    ]
+    return FeatureCollection(
+        [
+            Feature(geometry=Polygon([square, hole]), properties={"color": "6"}),
+            Feature(geometry=Polygon([small]), properties={"color": "6"}),
+            Feature(geometry=Polygon([square]), properties={"color": "0"}),
+        ]
+    )
+
+
+def test_post_process(marking_fc, bbox):
+    result = post_process(marking_fc, "sketch-map-1", bbox)
+    assert isinstance(result, FeatureCollection)
+    assert result.is_valid
+    assert len(result["features"]) == 1
+    feature = result["features"][0]
+    assert feature.properties == {"color": "red", "name": "sketch-map-1"}
+    assert feature.geometry.type == "Polygon"
+    assert len(feature.geometry.coordinates) == 1  # no inner rings
+
+
+def test_simplify(marking_fc):
+    fc = clean(marking_fc)
+    result = simplify(fc)
+    assert len(result["features"]) == 1  # dissolved
+    assert result["features"][0].properties == {"color": "6"}
+
+
+def test_smooth_skips_non_polygons():
+    polygon = Polygon([[(0, 0), (1, 0), (1, 1), (0, 0)]])
+    fc = FeatureCollection(
+        [
+            Feature(geometry=polygon, properties={"id": 1}),
+            Feature(geometry=Point((0, 0)), properties={"id": 2}),
+            Feature(geometry=MultiPolygon([polygon.coordinates]), properties={"id": 3}),
+        ]
+    )
+    result = smooth(fc)
+    assert len(result["features"]) == 1
+    assert result["features"][0].properties == {"id": 1}
+    assert result["features"][0].geometry.type == "Polygon"